@@ -16,6 +16,7 @@ import numpy as np
 nan = np.nan
 import pickle
 import core.CAS_tools as ct
+import core.CAS_ref_index as cri
 #import core.FF_Container as ffc
 
 outdir = './out/lsh_reviews/'
@@ -76,14 +77,9 @@ class CAS_review():
         
     def _get_ref_dic(self):
         # cas reference pickle created by 'CAS Reference dataset.ipynb'
-        with open(refdir+'cas_ref_dic_pickle.pkl','rb') as f:
-            self.cas_ref_dict = pickle.load(f)
-        
-        accum = 0
-        for cas in self.cas_ref_dict.keys():
-            accum += len(self.cas_ref_dict[cas])
+        self.cas_ref_dict = cri.get_index(refdir)
         print(f'Number of unique CAS_RN in reference dictionary: {len(self.cas_ref_dict)}')
-        print(f'Total number of synonyms in reference dictionary: {accum}')
+        print(f'Total number of synonyms in reference dictionary: {self.cas_ref_dict.num_synonyms()}')
         
     def _get_potentials(self,cas='7732-18-5'):
         with open(potentials_fn,'rb') as f:
@@ -166,7 +162,7 @@ class CAS_review():
         return lst
 
     def _show_ig_list(self,cas):
-        if cas in self.cas_ref_dict.keys():
+        if cas in self.cas_ref_dict:
             print('\n'*3+f'Ref ingredients for {cas}\n')
             for ig in self.cas_ref_dict[cas]:
                 print('  -> '+ig)
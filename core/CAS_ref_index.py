@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+CAS_ref_index is a compact, memory-mapped form of the CAS reference
+dictionary (CAS RN -> list of synonyms) made by
+CAS_ref/process_CAS_ref_files.py, and is used like that dictionary.  Keys
+that are not in the canonical CAS RN form are kept aside in a plain dict.
+"""
+import os, pickle, re, bisect
+import numpy as np
+import pandas as pd
+
+cas_pattern = r'[1-9][0-9]{1,6}-[0-9]{2}-[0-9]\Z'
+_cas_re = re.compile(cas_pattern)
+
+def encode_cas(cas):
+    """ the integer code of each CAS RN in `cas`; -1 for anything that is
+    not in the canonical form"""
+    s = pd.Series(np.atleast_1d(np.asarray(cas,dtype=object)),dtype=object)
+    ok = s.str.match(cas_pattern).fillna(False).values.astype(bool)
+    out = np.full(len(s),-1,dtype='int64')
+    if ok.any():
+        out[ok] = s[ok].str.replace('-','',regex=False).astype('int64').values
+    return out
+
+def encode_one(cas):
+    """ encode_cas for a single value, without the pandas overhead"""
+    if (not isinstance(cas,str)) or (_cas_re.match(cas) is None): return -1
+    return int(cas.replace('-',''))
+
+def decode_cas(code):
+    """ the CAS RN string of an integer code"""
+    d = str(code)
+    return f'{d[:-3]}-{d[-3:-1]}-{d[-1]}'
+
+
+class CAS_ref_index():
+    def __init__(self,dirname='./CAS_ref/out/cas_ref_index/'):
+        self.dirname = dirname
+        self.fns = {'keys':dirname+'keys.npy', # sorted CAS codes
+                    'key_syn':dirname+'key_syn.npy', # first synonym of each key
+                    'key_ins':dirname+'key_ins.npy', # keys in dict order
+                    'syn_off':dirname+'syn_off.npy', # byte offset of each synonym
+                    'other':dirname+'other.pkl', # the non-canonical keys
+                    'pool':dirname+'pool.npy'} # all synonyms, utf-8
+        self.codes = None
+        self.other = {}
+        self.other_pos = []
+        self._code_list = None
+
+    def exists(self):
+        return all(os.path.exists(fn) for fn in self.fns.values())
+
+    def is_current(self,other_fn):
+        """True when the index exists and is not older than `other_fn` (the
+        reference pickle it was made from)."""
+        if not self.exists(): return False
+        if not os.path.exists(other_fn): return True
+        return os.path.getmtime(self.fns['pool']) >= os.path.getmtime(other_fn)
+
+    def build(self,ref_dict):
+        """ make the index from the reference dictionary"""
+        cas = list(ref_dict.keys())
+        codes = encode_cas(cas)
+        # keys that can't be coded are kept as they are, with their place
+        # in the dictionary
+        self.other_pos = list(np.flatnonzero(codes<0))
+        self.other = {cas[j]:ref_dict[cas[j]] for j in self.other_pos}
+        keep = np.flatnonzero(codes>=0)
+        order = keep[np.argsort(codes[keep],kind='stable')]
+        self.codes = codes[order]
+        self._code_list = None
+        self.key_ins = np.argsort(order,kind='stable')
+        syns = []
+        self.key_syn = np.zeros(len(order)+1,dtype='int64')
+        for i,j in enumerate(order):
+            syns += ref_dict[cas[j]]
+            self.key_syn[i+1] = len(syns)
+        b = [s.encode('utf-8') for s in syns]
+        self.syn_off = np.zeros(len(b)+1,dtype='int64')
+        self.syn_off[1:] = np.cumsum([len(x) for x in b])
+        self.pool = np.frombuffer(b''.join(b),dtype='uint8')
+        return self
+
+    def save(self):
+        os.makedirs(self.dirname,exist_ok=True)
+        np.save(self.fns['keys'],self.codes)
+        np.save(self.fns['key_syn'],self.key_syn)
+        np.save(self.fns['key_ins'],self.key_ins)
+        np.save(self.fns['syn_off'],self.syn_off)
+        with open(self.fns['other'],'wb') as f:
+            pickle.dump({'other':self.other,'other_pos':self.other_pos},f)
+        # the pool is written last; its presence marks a complete index
+        np.save(self.fns['pool'],self.pool)
+
+    def load(self):
+        self.codes = np.load(self.fns['keys'],mmap_mode='r')
+        self._code_list = None
+        self.key_syn = np.load(self.fns['key_syn'],mmap_mode='r')
+        self.key_ins = np.load(self.fns['key_ins'],mmap_mode='r')
+        self.syn_off = np.load(self.fns['syn_off'],mmap_mode='r')
+        self.pool = np.load(self.fns['pool'],mmap_mode='r')
+        with open(self.fns['other'],'rb') as f:
+            dic = pickle.load(f)
+        self.other, self.other_pos = dic['other'], dic['other_pos']
+        return self
+
+    def lookup(self,cas):
+        """ the position of each of `cas` in the index, -1 if not found (or
+        one of the non-canonical keys)"""
+        c = encode_cas(cas)
+        pos = np.searchsorted(self.codes,c)
+        pos[pos>=len(self.codes)] = 0
+        found = (c>=0) & (np.asarray(self.codes)[pos]==c) if len(self.codes)>0 \
+                else np.zeros(len(c),dtype=bool)
+        return np.where(found,pos,-1)
+
+    def _lookup_one(self,cas):
+        """ lookup() of a single value; a bisect of a plain list of the codes
+        (made on first use) is much quicker than numpy for one value"""
+        if self._code_list is None: self._code_list = np.asarray(self.codes).tolist()
+        c = encode_one(cas)
+        if c<0: return -1
+        pos = bisect.bisect_left(self._code_list,c)
+        if (pos<len(self._code_list)) and (self._code_list[pos]==c): return pos
+        return -1
+
+    def isin(self,cas):
+        """ vectorized membership: True for each of `cas` in the index"""
+        found = self.lookup(cas)>=0
+        if len(self.other)>0:
+            s = pd.Series(np.atleast_1d(np.asarray(cas,dtype=object)),dtype=object)
+            found |= s.isin(list(self.other.keys())).values
+        return found
+
+    def synonyms(self,pos):
+        """ the list of synonyms of the key at position `pos`"""
+        off = np.asarray(self.syn_off[self.key_syn[pos]:self.key_syn[pos+1]+1]).tolist()
+        b = bytes(self.pool[off[0]:off[-1]])
+        return [b[i-off[0]:j-off[0]].decode('utf-8') for i,j in zip(off[:-1],off[1:])]
+
+    def num_synonyms(self):
+        return int(self.key_syn[-1]) + sum(len(v) for v in self.other.values())
+
+    def _dict_order(self,canon,other):
+        """ one list of the items of the canonical keys (in dictionary order)
+        and of the other keys, in the order of the reference dictionary"""
+        out = list(canon)
+        for pos,item in zip(self.other_pos,other):
+            out.insert(pos,item)
+        return out
+
+    def all_synonyms(self):
+        """ the synonyms of all keys, in the order of keys()"""
+        out = []
+        for syns in self._dict_order((self.synonyms(pos) for pos in self.key_ins),
+                                     self.other.values()):
+            out += syns
+        return out
+
+    def keys(self):
+        """ the keys in the order of the reference dictionary"""
+        return self._dict_order((decode_cas(c) for c in np.asarray(self.codes)[self.key_ins]),
+                                self.other.keys())
+
+    def __len__(self):
+        return len(self.codes) + len(self.other)
+
+    def __contains__(self,cas):
+        return (self._lookup_one(cas)>=0) or (cas in self.other)
+
+    def __getitem__(self,cas):
+        pos = self._lookup_one(cas)
+        if pos>=0: return self.synonyms(pos)
+        if cas in self.other: return self.other[cas]
+        raise KeyError(cas)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+def get_index(refdir='./CAS_ref/out/'):
+    """ the CAS reference index for `refdir`, (re)made from the reference
+    pickle when that is newer than the saved index.  It stands in for the
+    unpickled reference dictionary: it is memory-mapped, so opening it is
+    quick and it takes little memory."""
+    pkl_fn = refdir+'cas_ref_dic_pickle.pkl'
+    idx = CAS_ref_index(refdir+'cas_ref_index/')
+    if idx.is_current(pkl_fn):
+        return idx.load()
+    print('Making CAS reference index')
+    with open(pkl_fn,'rb') as f:
+        idx.build(pickle.load(f))
+    idx.save()
+    return idx.load()
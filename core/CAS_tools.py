@@ -7,8 +7,10 @@ Created on Sun Jan 20 11:14:52 2019
 collection of tools for working with CAS RNs
 """
 import re
+import numpy as np
 import pandas as pd
 from fuzzywuzzy import process
+import core.Fuzzy_index as fi
 
 refdir = './out/'
 
@@ -75,7 +77,141 @@ def correct_zeros(cas):
     if (len(lst[0])<2 or len(lst[0])>7): return cas
    
     return f'{lst[0]}-{lst[1]}-{lst[2]}'
-    
+
+def _cas_parts(cas):
+    """ parse a whole array of strings at once.  The strings become a matrix
+    of character codes (one row per string) so that the positions of the 
+    hyphens, the lengths of the three sections and the digit checks are all
+    numpy operations.  Non-string entries are treated as unparseable."""
+    arr = np.asarray(cas,dtype=object).ravel()
+    isstr = np.array([isinstance(x,str) for x in arr],dtype=bool)
+    u = np.where(isstr,arr,'').astype('U')
+    n = len(u)
+    w = max(u.dtype.itemsize//4,1)
+    C = u.view('uint32').reshape(n,w) if n>0 else np.zeros((0,w),dtype='uint32')
+    length = (C!=0).sum(axis=1)
+    pos = np.arange(w,dtype='int32')
+    is_hyph = C==ord('-')
+    nhyph = is_hyph.sum(axis=1)
+    three = isstr & (nhyph==2)
+    # position of first and second hyphen (w where missing)
+    hpos = np.where(is_hyph,pos,w)
+    h1 = hpos.min(axis=1)
+    h2 = np.where(is_hyph & (pos>h1[:,None]),pos,w).min(axis=1)
+    return {'arr':arr,'isstr':isstr,'C':C,'length':length,'pos':pos,
+            'three':three,'h1':h1,'h2':h2,
+            'len0':h1,'len1':h2-h1-1,'len2':length-h2-1}
+
+def _valid_from_parts(p):
+    valid = p['three'] & (p['len2']==1) & (p['len1']==2) & \
+            (p['len0']>=2) & (p['len0']<=7)
+    # the rest is only worked out for the candidates that are left
+    idx = np.flatnonzero(valid)
+    C,pos = p['C'][idx],p['pos']
+    h1,h2 = p['h1'][idx,None],p['h2'][idx,None]
+    is_digit = (C>=ord('0')) & (C<=ord('9'))
+    inside = pos<p['length'][idx,None]
+    ok = ~((~is_digit) & (C!=ord('-')) & inside).any(axis=1)
+    ok &= C[:,0]!=ord('0') # leading zeros not allowed
+    # validate check digit: weight of each digit is its place counting 
+    # back from the check digit (hyphens get no weight)
+    d = np.where(is_digit,C.astype('int32')-ord('0'),0)
+    wt = np.where(pos<h1,h1-pos+2,np.where((pos>h1)&(pos<h2),h2-pos,0))
+    accum = (d*wt).sum(axis=1)
+    check = d[np.arange(len(idx)),p['h2'][idx]+1]
+    valid[idx] = ok & (accum%10==check)
+    return valid
+
+def is_valid_CAS_array(cas):
+    """ is_valid_CAS_code for a whole Series/array at once; returns a 
+    boolean array"""
+    return _valid_from_parts(_cas_parts(cas))
+
+def correct_zeros_array(cas):
+    """ correct_zeros for a whole Series/array at once; returns an object
+    array (non-string entries are passed through).  Only the entries that
+    actually change are rebuilt as strings."""
+    p = _cas_parts(cas)
+    C,pos = p['C'],p['pos']
+    # number of leading zeros in section 1
+    nz = np.where((C!=ord('0')) | (pos>=p['h1'][:,None]),pos,C.shape[1]).min(axis=1)
+    len0 = p['len0'] - np.minimum(nz,p['len0'])
+    fix = p['three'] & (p['len2']==1) & ((p['len1']==1)|(p['len1']==2)) & \
+          (len0>=2) & (len0<=7)
+    # only where a zero is actually added or removed (those are never
+    # already valid)
+    fix &= ((p['len1']==1) | (len0<p['len0']))
+    out = p['arr'].copy()
+    for i in np.flatnonzero(fix):
+        lst = out[i].split('-')
+        out[i] = f"{lst[0].lstrip('0')}-{lst[1]:0>2}-{lst[2]}"
+    return out
+
+# single-error edits of the digits of a CAS RN, most likely first
+typo_edits = ['hyphen','transpose','substitute','delete','insert']
+
+def _digit_edits(d):
+    """ (digits, edit type) of the single-error variants of the digit 
+    string `d`; 'hyphen' is `d` itself (only the hyphens were wrong)"""
+    out = [(d,'hyphen')]
+    for i in range(len(d)-1):
+        if d[i]!=d[i+1]:
+            out.append((d[:i]+d[i+1]+d[i]+d[i+2:],'transpose'))
+    for i in range(len(d)):
+        for c in '0123456789':
+            if c!=d[i]: out.append((d[:i]+c+d[i+1:],'substitute'))
+    for i in range(len(d)):
+        out.append((d[:i]+d[i+1:],'delete'))
+    for i in range(len(d)+1):
+        for c in '0123456789':
+            out.append((d[:i]+c+d[i:],'insert'))
+    return out
+
+def cas_typo_table(caslst,ref_index=None):
+    """ the typo candidates of all of `caslst` at once: a df with the
+    position in caslst ('src'), the 'candidate' CAS RN, its 'edit' type and
+    'rank' (order in typo_edits).  Candidates must have a correct check
+    digit and, if `ref_index` (a CAS_ref_index) is given, be in it."""
+    src = []; cand = []; rank = []
+    for i,cas in enumerate(caslst):
+        if not isinstance(cas,str): continue
+        d = cas.replace('-','').lstrip('0')
+        if (not d.isdigit()) or len(d)<4 or len(d)>11: continue
+        for dd,edit in _digit_edits(d):
+            if len(dd)<5 or len(dd)>10: continue
+            src.append(i)
+            cand.append(f'{dd[:-3]}-{dd[-3:-1]}-{dd[-1]}')
+            rank.append(typo_edits.index(edit))
+    df = pd.DataFrame({'src':np.array(src,dtype='int64'),
+                       'candidate':np.array(cand,dtype=object),
+                       'rank':np.array(rank,dtype='int64')})
+    keep = is_valid_CAS_array(df.candidate)
+    if ref_index is not None:
+        keep[keep] = ref_index.isin(df.candidate[keep])
+    df = df[keep].sort_values(['src','rank'],kind='mergesort')
+    df = df.drop_duplicates(subset=['src','candidate'],keep='first')
+    df['edit'] = np.asarray(typo_edits,dtype=object).take(df['rank'].values)
+    return df.reset_index(drop=True)
+
+def cas_typo_candidates(cas,ref_index=None):
+    """ likely single-error corrections of a malformed CAS RN (misplaced
+    hyphens, adjacent transposition, wrong digit, extra or dropped digit)
+    as a list of (candidate, edit type), best first."""
+    df = cas_typo_table([cas],ref_index)
+    return list(zip(df.candidate,df.edit))
+
+def resolve_cas_typos(caslst,ref_index):
+    """ for each of `caslst`, the corrected CAS RN and the edit type when 
+    there is exactly one reference candidate of the best edit type; None
+    where there is no candidate or the best ones are ambiguous."""
+    df = cas_typo_table(caslst,ref_index)
+    best = df[df['rank']==df.groupby('src')['rank'].transform('min')]
+    best = best[~best.duplicated(subset='src',keep=False)]
+    fixed = np.full(len(caslst),None,dtype=object)
+    edit = np.full(len(caslst),None,dtype=object)
+    fixed[best.src.values] = best.candidate.values
+    edit[best.src.values] = best.edit.values
+    return fixed, edit
 
 def best_guess_scores(name,complist,min_score=95):
     #uses fuzzy wuzzy to find matches within a comparison list
@@ -93,10 +229,25 @@ def closest_CAS_match(cas,validlst,min_score=50):
     if res==[] : return cas
     return res[0][0]
 
+_name_index = {} # the Fuzzy_index of the last name list searched
+
+def get_name_index(complist):
+    """ a Fuzzy_index of `complist`, made once and reused for as long as the
+    same, unchanged list is searched"""
+    if isinstance(complist,fi.Fuzzy_index): return complist
+    key = id(complist)
+    if (key not in _name_index) or (_name_index[key][0]!=complist):
+        _name_index.clear()
+        _name_index[key] = (list(complist),fi.Fuzzy_index(list(complist)))
+    return _name_index[key][1]
+
 def best_guess_name(name,complist,min_score=95):
     #uses fuzzy wuzzy to find matches within a comparison list
+    # complist is searched through its Fuzzy_index (get_name_index): the
+    # same results as process.extract, much faster when a big list is
+    # searched repeatedly
     try:
-        res = process.extract(name,complist)
+        res = get_name_index(complist).extract(name)
         out = []
         for r in res:
             if r[1] >= min_score:
@@ -7,8 +7,9 @@ Created on Tue Jun 25 07:59:02 2019
 import pandas as pd
 import numpy as np
 import core.CAS_tools as ct
-import pickle
-#import core.Parse_raw as praw
+import core.DQ_flags as dq
+import core.CAS_ref_index as cri
+import core.Parse_raw as praw
 
 class Categorize_records():
     """ This class sorts all data in the dataframe into one of the following
@@ -21,13 +22,19 @@ class Categorize_records():
     This work proceeds in phases:
     Phase I: Find records which match CAS authority. 
     
+    Everything phases I and II need to know about a CASNumber is worked out
+    once per distinct value, in one table (cas_field_cat), and carried to
+    the records by the position of their CASNumber in that table.
         """
         
-    def __init__(self,df,praw):
+    def __init__(self,df,praw,resolve_cas_typos=False):
         """df is the master FF data set being analyzed.
         praw is the Parse_raw object that set up the field_cat sets
+        resolve_cas_typos: give unmatched CASNumbers the bgCAS of their only
+        likely single-typo correction (see CAS_tools.resolve_cas_typos)
         """
         self.df = df
+        self.resolve_cas_typos = resolve_cas_typos
         self.praw = praw
         self.cas_field_cat = self.praw.get_field_cat('CASNumber')
         self.refdir = './CAS_ref/out/'
@@ -36,17 +43,13 @@ class Categorize_records():
         # column that identifies the labels that signify the 'proprietary' status
         # Those identifiers were added manually through inspection of the CAS list.
         self.cas_labels_fn = './out/currentData/cas_labels.csv'
+        self.cas_cols = [] # columns of cas_field_cat to add to df
 
     def _get_ref_dic(self):
         # cas reference pickle created by 'CAS Reference dataset.ipynb'
-        with open(self.refdir+'cas_ref_dic_pickle.pkl','rb') as f:
-            self.cas_ref_dict = pickle.load(f)
-        
-        accum = 0
-        for cas in self.cas_ref_dict.keys():
-            accum += len(self.cas_ref_dict[cas])
+        self.cas_ref_dict = cri.get_index(self.refdir)
         print(f'Number of unique CAS_RN in reference dictionary: {len(self.cas_ref_dict)}')
-        print(f'Total number of synonyms in reference dictionary: {accum}')
+        print(f'Total number of synonyms in reference dictionary: {self.cas_ref_dict.num_synonyms()}')
         
         
 ###  Phase I - find valid records based on legimate CASNumber
@@ -55,25 +58,64 @@ class Categorize_records():
         #print('clean cas for comparison')
         self.cas_field_cat.rename({'original':'CASNumber'},inplace=True,axis=1)
         self.cas_field_cat['cas_clean'] = self.cas_field_cat.CASNumber.str.replace(r'[^0-9-]','')
-        self.cas_field_cat['zero_corrected'] = self.cas_field_cat.cas_clean.map(lambda x: ct.correct_zeros(x) )
+        self.cas_field_cat['zero_corrected'] = ct.correct_zeros_array(self.cas_field_cat.cas_clean)
         
     def _mark_if_perfect_match(self):
-        self.cas_ref_lst = list(self.cas_ref_dict.keys())
-        self.cas_field_cat['perfect_match'] = self.cas_field_cat.zero_corrected.isin(self.cas_ref_lst)
+        self.cas_field_cat['perfect_match'] = self.cas_ref_dict.isin(self.cas_field_cat.zero_corrected)
         self.cas_field_cat['bgCAS'] = np.where(self.cas_field_cat.perfect_match,
                                                self.cas_field_cat.zero_corrected,
                                                'cas_unresolved')
-        tmp = self.cas_field_cat[['CASNumber','perfect_match','bgCAS']].copy()
-        self.df = pd.merge(self.df,tmp,on='CASNumber',how='left',validate='m:1')
-        
-    def phaseI(self):
+        cols = ['CASNumber','perfect_match','bgCAS']
+        if self.resolve_cas_typos:
+            self._resolve_typos()
+            cols.append('cas_typo')
+        self.cas_cols += cols[1:]
+        
+    def _resolve_typos(self):
+        """ these are not perfect matches (no 'P' flag); 'cas_typo' has
+        the kind of edit that was made"""
+        unres = ~self.cas_field_cat.perfect_match
+        fixed, edit = ct.resolve_cas_typos(list(self.cas_field_cat.zero_corrected[unres]),
+                                           self.cas_ref_dict)
+        self.cas_field_cat['cas_typo'] = None
+        self.cas_field_cat.loc[unres,'cas_typo'] = edit
+        ok = self.cas_field_cat.cas_typo.notna()
+        self.cas_field_cat.loc[unres,'bgCAS'] = np.where(pd.notna(fixed),fixed,
+                                                         self.cas_field_cat.bgCAS[unres])
+        print(f'Number of CASNumbers resolved as typos: {ok.sum()}')
+
+    def _cas_table_rows(self):
+        """ for each record, the row of cas_field_cat for its CASNumber.  A
+        record whose CASNumber is not in the table gets an extra, empty row
+        (as it would from a left merge)."""
+        codes,uniques = pd.factorize(self.df.CASNumber)
+        pos = pd.Index(self.cas_field_cat.CASNumber).get_indexer(uniques)
+        n = len(self.cas_field_cat)
+        pos = np.append(np.where(pos<0,n,pos),n) # codes of -1 (NaN) too
+        return pos.take(codes)
+
+    def _add_cas_columns(self):
+        """ add all the cas_cols to df in one step"""
+        rows = self._cas_table_rows()
+        tab = self.cas_field_cat[self.cas_cols]
+        if (rows==len(tab)).any():
+            tab = pd.concat([tab,pd.DataFrame(index=[-1],columns=self.cas_cols)])
+        for col in self.cas_cols:
+            self.df[col] = tab[col].values.take(rows)
+
+    def _make_cas_table(self):
         self._clean_CAS_for_comparison()
         self._mark_if_perfect_match()
+        self._add_proprietary_column()
+        self._add_hiding_column()
+
+    def phaseI(self):
+        self._make_cas_table()
+        self._add_cas_columns()
         print(f'Number of perfect matches: {self.cas_field_cat.perfect_match.sum()}')
         print(f'Total records affected:    {self.df.perfect_match.sum()}\n')
-        self.df.DQ_code = np.where(self.df.perfect_match,
-                                   self.df.DQ_code.str[:]+'-P',
-                                   self.df.DQ_code)
+        self.df.DQ_flags = dq.set_flag(self.df.DQ_flags,self.df.perfect_match,
+                                       dq.PERFECT_MATCH)
         
         
 ###  Phase II - Proprietary claims 
@@ -81,58 +123,65 @@ class Categorize_records():
         labels = pd.read_csv(self.cas_labels_fn,keep_default_na=False,na_values='')
         prop_lst = list(labels[labels.proprietary==1].clean.str.lower().str.strip().unique())
         self.cas_field_cat['proprietary'] = self.cas_field_cat.CASNumber.str.lower().str.strip().isin(prop_lst)
-        tmp = self.cas_field_cat[['CASNumber','proprietary']].copy()
-        self.df = pd.merge(self.df,tmp,on='CASNumber',how='left',validate='m:1')
+        self.cas_cols.append('proprietary')
         
     def _add_hiding_column(self):
         labels = pd.read_csv(self.cas_labels_fn,keep_default_na=False,na_values='')
         hiding_lst = list(labels[labels.hiding==1].clean.str.lower().str.strip().unique())
         self.cas_field_cat['un_cas_like'] = self.cas_field_cat.CASNumber.str.lower().str.strip().isin(hiding_lst)
-        tmp = self.cas_field_cat[['CASNumber','un_cas_like']].copy()
-        self.df = pd.merge(self.df,tmp,on='CASNumber',how='left',validate='m:1')
+        self.cas_cols.append('un_cas_like')
 
     def phaseII(self):
         """DQ_code for explicit proprietary is 3
                     for non_cas_like CAS Number but with quantity = 4
-                    for non_cas_like CAS Number but absent quantity = 5"""
-        self._add_proprietary_column()
+                    for non_cas_like CAS Number but absent quantity = 5
+        (the 'proprietary' and 'un_cas_like' columns were added in phase I)"""
         print(f'Total Proprietary records= {self.df.proprietary.sum()}')
         
-        self.df.DQ_code = np.where(self.df.proprietary,
-                                   self.df.DQ_code.str[:]+'-3',
-                                   self.df.DQ_code)
+        self.df.DQ_flags = dq.set_flag(self.df.DQ_flags,self.df.proprietary,
+                                       dq.PROPRIETARY)
         
         
-        self._add_hiding_column()
         cond1 = self.df.PercentHFJob>0
         cond2 = self.df.MassIngredient>0
         has_quant = cond1 | cond2
         not_quant = ~has_quant
         cond3 = self.df.un_cas_like
-        self.df.DQ_code = np.where(cond3&has_quant,
-                                self.df.DQ_code.str[:]+'-4',
-                                self.df.DQ_code)
-        self.df.DQ_code = np.where(cond3&not_quant,
-                                self.df.DQ_code.str[:]+'-5',
-                                self.df.DQ_code)
-        print(f'Total Non_caslike but quant = {len(self.df[self.df.DQ_code.str.contains("4",regex=False)])}')
+        self.df.DQ_flags = dq.set_flag(self.df.DQ_flags,cond3&has_quant,
+                                       dq.NONCAS_QUANT)
+        self.df.DQ_flags = dq.set_flag(self.df.DQ_flags,cond3&not_quant,
+                                       dq.NONCAS_NOQUANT)
+        print(f'Total Non_caslike but quant = {dq.has_flag(self.df.DQ_flags,dq.NONCAS_QUANT).sum()}')
 #        print(f'Total Non_caslike but not quant = {len(t[t.DQ_code==5])}')
         
 ### Phase III - check for duplicates
+    def _row_fingerprints(self,cols):
+        """ a 64-bit hash of the values of `cols` in each record"""
+        fp = np.zeros(len(self.df),dtype='uint64')
+        for col in cols:
+            ser = self.df[col]
+            if ser.dtype.kind=='f': ser = ser+0.0 # so -0.0 hashes as 0.0
+            fp = fp*np.uint64(1000003) ^ pd.util.hash_pandas_object(ser,index=False).values
+        return fp
+
     def _flag_duplicated_records(self):
-        self.df['dup'] = self.df.duplicated(subset=['UploadKey','IngredientName',
-                                       'CASNumber','MassIngredient','PercentHFJob'],
-                                        keep=False)
-        c0 = ~self.df.IngredientKey.isna()
-        cP = self.df.DQ_code.str.contains('P',regex=False)
-        dups = self.df[(self.df.dup)&(c0)&(cP)].copy()
-        c1 = dups.Supplier.str.lower().isin(['listed above'])
-        c2 = dups.Purpose.str.lower().str[:9]=='see trade'
-        dups['redundant_rec'] = c1&c2
-        #print(f' Expected redundant total: {dups.redundant_rec.sum()}, {c1.sum()}, {c2.sum()}')
-        #print(f'dups len = {len(dups)}, inKey len = {len(dups.IngredientKey.unique())}')
-        self.df = pd.merge(self.df,dups[['IngredientKey','redundant_rec']],
-                           on='IngredientKey',how='left',validate='m:1')
+        # the ingredient table of the split tables carries 'evkey' instead
+        evcol = 'UploadKey' if 'UploadKey' in self.df.columns else 'evkey'
+        cols = [evcol,'IngredientName','CASNumber','MassIngredient','PercentHFJob']
+        dup = praw.shared_fingerprints(self._row_fingerprints(cols),self.df,cols)
+        self.df['dup'] = dup
+        c0 = ~self.df.IngredientKey.isna().values
+        cP = dq.has_flag(self.df.DQ_flags,dq.PERFECT_MATCH)
+        idx = np.flatnonzero(dup&c0&cP)
+        dups = self.df[['Supplier','Purpose']].iloc[idx]
+        c1 = dups.Supplier.str.lower().isin(['listed above']).values
+        c2 = (dups.Purpose.str.lower().str[:9]=='see trade').values
+        self.redundant = np.zeros(len(dup),dtype=bool)
+        self.redundant[idx[c1&c2]] = True
+        # 'redundant_rec' is only defined (True/False) for those checked
+        rec = np.full(len(dup),np.NaN,dtype=object)
+        rec[idx] = c1&c2
+        self.df['redundant_rec'] = rec
 
     def phaseIII(self):
         """ > 75000 records are duplicated within events apparently due to the
@@ -141,10 +190,9 @@ class Categorize_records():
         all duplicates (by 5 fields) then flag those that have the supplier/purpose
         characteristic -- DQ_code is R."""
         self._flag_duplicated_records()
-        self.df.DQ_code = np.where(self.df.redundant_rec==True,
-                                self.df.DQ_code.str[:]+'-R',
-                                self.df.DQ_code)
-        print(f'Total redundant records flagged: {len(self.df[self.df.DQ_code.str.contains("R",regex=False)])}')
+        self.df.DQ_flags = dq.set_flag(self.df.DQ_flags,self.redundant,
+                                       dq.REDUNDANT)
+        print(f'Total redundant records flagged: {dq.has_flag(self.df.DQ_flags,dq.REDUNDANT).sum()}')
         
     def do_all(self):
         self.phaseI()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Col_store keeps a dataframe on disk as one file per column, so a caller can
+load only the columns (and rows) it needs.  A store can also hold named
+per-row indexes, such as the DQ_flags bitmask, to pick rows before loading.
+"""
+import os, shutil, pickle
+import numpy as np
+import pandas as pd
+
+
+class Col_store():
+    def __init__(self,dirname):
+        self.dirname = dirname
+        self.meta_fn = self.dirname+'_meta.pkl'
+        # text columns with more unique values than this fraction of the
+        # rows are not worth encoding as codes.
+        self.max_uni_frac = 0.5
+
+    def exists(self):
+        return os.path.exists(self.meta_fn)
+
+    def is_current(self,other_fn):
+        """True when the store exists and is not older than `other_fn` (e.g.
+        the pickle it would replace)."""
+        if not self.exists(): return False
+        if not os.path.exists(other_fn): return True
+        return os.path.getmtime(self.meta_fn) >= os.path.getmtime(other_fn)
+
+    def _get_meta(self):
+        with open(self.meta_fn,'rb') as f:
+            return pickle.load(f)
+
+    def get_columns(self):
+        return self._get_meta()['columns']
+
+    def _save_col(self,ser,root):
+        """ save a single column, returning its 'kind' """
+        dt = ser.dtype
+        if str(dt)=='category':
+            np.save(root+'_codes.npy',ser.cat.codes.values)
+            with open(root+'_cats.pkl','wb') as f:
+                pickle.dump(ser.cat.categories,f)
+            return 'category'
+        if isinstance(dt,pd.api.extensions.ExtensionDtype) and \
+           hasattr(dt,'numpy_dtype'): # Int64, boolean, etc
+            np.save(root+'_data.npy',ser.to_numpy(dtype=dt.numpy_dtype,
+                                                  na_value=0))
+            np.save(root+'_mask.npy',ser.isna().values)
+            return 'masked'
+        if isinstance(dt,np.dtype) and dt.kind in 'biufcmM':
+            np.save(root+'.npy',ser.values)
+            return 'array'
+        if dt=='object':
+            codes,uniques = pd.factorize(ser)
+            if len(uniques) <= self.max_uni_frac*len(ser):
+                np.save(root+'_codes.npy',codes)
+                with open(root+'_cats.pkl','wb') as f:
+                    pickle.dump(uniques,f)
+                return 'object_codes'
+        ser.to_pickle(root+'.pkl')
+        return 'pickle'
+
+    def save(self,df):
+        print(f'Saving {len(df.columns)} columns to store: {self.dirname}')
+        if os.path.exists(self.dirname): shutil.rmtree(self.dirname)
+        os.makedirs(self.dirname)
+        meta = {'columns':list(df.columns),'nrows':len(df),
+                'roots':{},'kinds':{},'dtypes':{}}
+        # the row labels are only kept when they aren't just 0..n-1
+        meta['labels'] = 'default'
+        if not df.index.equals(pd.RangeIndex(len(df))):
+            df.index.to_series().reset_index(drop=True).to_pickle(self.dirname+'labels.pkl')
+            meta['labels'] = 'pickle'
+        for i,col in enumerate(df.columns):
+            root = f'c{i:03d}'
+            meta['roots'][col] = root
+            meta['dtypes'][col] = df[col].dtype
+            meta['kinds'][col] = self._save_col(df[col],self.dirname+root)
+        # the meta file is written last; its presence marks a complete store
+        with open(self.meta_fn,'wb') as f:
+            pickle.dump(meta,f)
+
+    def save_index(self,name,arr):
+        """ save a per-row array alongside the columns of an existing store"""
+        np.save(self.dirname+name+'_index.npy',np.asarray(arr))
+
+    def load_index(self,name):
+        """ memory-mapped per-row index, or None if it was never saved"""
+        fn = self.dirname+name+'_index.npy'
+        if not os.path.exists(fn): return None
+        return np.load(fn,mmap_mode='r')
+
+    def _load_col(self,meta,col,rows):
+        root = self.dirname+meta['roots'][col]
+        kind = meta['kinds'][col]
+        def take(arr):
+            if rows is None: return arr
+            return arr[rows]
+        if kind=='array':
+            # pd.DataFrame copies these into memory; only the requested
+            # columns (and rows) are ever read from disk.
+            return take(np.load(root+'.npy',mmap_mode='r'))
+        if kind=='masked':
+            data = np.array(take(np.load(root+'_data.npy',mmap_mode='r')))
+            mask = np.array(take(np.load(root+'_mask.npy',mmap_mode='r')))
+            return meta['dtypes'][col].construct_array_type()(data,mask)
+        if kind in ['category','object_codes']:
+            codes = take(np.load(root+'_codes.npy',mmap_mode='r'))
+            with open(root+'_cats.pkl','rb') as f:
+                cats = pickle.load(f)
+            if kind=='category':
+                return pd.Categorical.from_codes(codes,dtype=meta['dtypes'][col])
+            out = np.asarray(cats,dtype=object).take(codes)
+            out[codes<0] = np.NaN
+            return out
+        ser = pd.read_pickle(root+'.pkl')
+        if rows is None: return ser.array
+        return ser.array[rows]
+
+    def _load_labels(self,meta,rows):
+        """ the row labels of the saved dataframe (of `rows`)"""
+        if meta.get('labels','default')=='default':
+            if rows is None: return pd.RangeIndex(meta['nrows'])
+            return pd.Index(rows)
+        labels = pd.Index(pd.read_pickle(self.dirname+'labels.pkl'))
+        if rows is None: return labels
+        return labels[rows]
+
+    def load(self,col_list=None,rows=None):
+        """ load `col_list` (default: all columns) from the store.  `rows` is
+        an optional array of row positions to keep.  The rows keep the labels
+        they had in the saved dataframe."""
+        meta = self._get_meta()
+        if col_list is None: col_list = meta['columns']
+        print(f'Fetching {len(col_list)} columns from store: {self.dirname}')
+        dic = {}
+        for col in col_list:
+            dic[col] = self._load_col(meta,col,rows)
+        return pd.DataFrame(dic,columns=col_list,
+                            index=self._load_labels(meta,rows))
@@ -6,11 +6,56 @@ Created on Sun Mar  3 19:32:35 2019
 
 This is used to correct names such as suplier, tradename, etc...
 
+The fuzzy guesses for every word can be collected ahead of the review with
+`collect_guesses`; with big vocabularies (trade names) this is spread over a
+pool of processes.  Finished guesses are appended, a batch at a time, to a
+log file next to the guess dictionary, so an interrupted run picks up where
+it stopped.
 """
+import os
 import pandas as pd
-from fuzzywuzzy import process
 import core.FF_Container as ffc
+import core.Fuzzy_index as fi
 import pickle
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# set in each worker process by _init_guess_worker
+_worker_index = None
+_worker_words = None
+
+def _init_guess_worker(words):
+    """ build the fuzzy index once per worker process"""
+    global _worker_index, _worker_words
+    _worker_words = words
+    _worker_index = fi.Fuzzy_index(list(words.keys()))
+
+def _guess_batch(terms,min_score=20,limit=200):
+    """ the guesses (name, score, count) for each of `terms`, as a list of
+    (term, guesses).  Kept at the module level so it can be sent to a
+    process pool."""
+    out = []
+    for term in terms:
+        res = _worker_index.extract(term,limit=limit,score_cutoff=min_score)
+        out.append((term,[(r[0],r[1],_worker_words[r[0]]) for r in res]))
+    return out
+
+def read_guess_log(fn):
+    """ the {term: guesses} recorded in the append-only log `fn`.  A batch
+    cut short by an interruption is dropped from the file, so that later
+    batches are appended after the last complete one."""
+    dic = {}
+    if not os.path.exists(fn): return dic
+    with open(fn,'r+b') as f:
+        good = 0
+        while True:
+            try:
+                batch = pickle.load(f)
+            except (EOFError,pickle.UnpicklingError,ValueError):
+                break
+            dic.update(batch)
+            good = f.tell()
+        f.truncate(good)
+    return dic
 
 class Column_corrector():
     def __init__(self,ver_name='CurrentData',colName='sup_clean',
@@ -21,17 +66,21 @@ class Column_corrector():
         self.outfn = self.outdir+'review_'+self.colName+'.csv'
         self.WORDS = self.getWORDS(self.get_input_list())
         self.wlst = self.get_sorted_words()
+        self.fuzzy = fi.Fuzzy_index(list(self.WORDS.keys()))
         self.res_dic = self.get_results_dic()
         self.groups = {}
         self.assemble_groups()
         self.guessdir = self.outdir+'guess/'
         self.guessdicfn = self.guessdir+self.colName+'guessdic.pkl'
+        self.guesslogfn = self.guessdir+self.colName+'guesslog.pkl'
         try:
             with open(self.guessdicfn,'rb') as f:
                 self.guessdic = pickle.load(f)
             
         except:
             self.guessdic = {}
+        # guesses from a collect_guesses run that did not finish
+        self.guessdic.update(read_guess_log(self.guesslogfn))
         
     def get_input_list(self):
         c = ffc.FF_Container(self.FFver)
@@ -81,26 +130,35 @@ class Column_corrector():
         df.to_csv(self.outfn,index=False)
         
     def make_not_assigned_lst(self):
-        self.not_assigned = []
+        # the set of unassigned words and their total count are built once
+        # here, then kept up to date by `assign`
+        self.not_assigned = set()
+        self.open_fuzzy = None # index of the unassigned words, made when needed
+        self.tot_cnt = 0
+        self.not_assigned_cnt = 0
         for w in self.wlst:
+            cnt = self.WORDS[w] if w != 'nan' else 0
+            self.tot_cnt += cnt
             if w not in self.res_dic:
-                self.not_assigned.append(w)
+                self.not_assigned.add(w)
+                self.not_assigned_cnt += cnt
      
     def is_not_assigned(self,w):
-        if w in self.not_assigned:
-            return True
-        return False
+        return w in self.not_assigned
+
+    def assign(self,word,group):
+        """ put `word` in `group`, keeping the unassigned set and count
+        current"""
+        self.res_dic[word] = group
+        self.add_word_to_groups(group,word)
+        if word in self.not_assigned:
+            self.not_assigned.discard(word)
+            if self.open_fuzzy is not None: self.open_fuzzy.delete(word)
+            if word != 'nan':
+                self.not_assigned_cnt -= self.WORDS[word]
 
     def get_frac_not_assigned(self):
-        tot = 0
-        notassign = 0
-        for w in self.WORDS:
-            cnt = self.WORDS[w]
-            if w != 'nan':
-                tot += cnt
-                if self.is_not_assigned(w):
-                    notassign += cnt
-        return notassign/tot
+        return self.not_assigned_cnt/self.tot_cnt
     
     def best_guess_scores(self,name,min_score=20):
         #uses fuzzy wuzzy to find matches within a comparison list
@@ -109,12 +167,11 @@ class Column_corrector():
             print('in self.guessdic')
         else:
             print('NOT in self.guessdic')
-            complst = []
-            for w in self.WORDS:
-                if self.is_not_assigned(w):
-                    complst.append(w)
-            res = process.extract(name,complst,
-                                  limit=30)
+            # only the words not yet assigned are candidates
+            if self.open_fuzzy is None:
+                self.open_fuzzy = fi.Fuzzy_index([w for w in self.WORDS
+                                                  if w in self.not_assigned])
+            res = self.open_fuzzy.extract(name,limit=30)
         #print(f'({name}):, {res}')
         out = []
         for r in res:
@@ -126,8 +183,7 @@ class Column_corrector():
     def best_guess_scores_full(self,name,min_score=20):
         #uses fuzzy wuzzy to find matches within a comparison list
         # this version for preloading - collect_guesses.
-        res = process.extract(name,self.WORDS.keys(),
-                              limit=200)
+        res = self.fuzzy.extract(name,limit=200)
         #print(res)
         out = []
         for r in res:
@@ -149,36 +205,73 @@ class Column_corrector():
                       res[0],res[1],res[2]))
         return bgl 
 
-    def collect_guesses(self):
+    def _needs_guess(self,term):
+        # some values were initially misrecorded. This corrects them
+        if term in self.guessdic: 
+            if isinstance(self.guessdic[term],list) == True: return False
+        if len(term)<3 : return False
+        if term=='---' : return False
+        if term[0]=='/': return False
+        return True
+
+    def _append_guess_log(self,batch):
+        """ add a finished batch of guesses to the log; each batch is one
+        pickle appended to the file, so nothing already there is rewritten."""
+        with open(self.guesslogfn,'ab') as f:
+            pickle.dump(dict(batch),f)
+            f.flush()
+            os.fsync(f.fileno())
+        self.guessdic.update(batch)
+
+    def _save_guessdic(self):
+        """ fold the log into the guess dictionary pickle"""
+        tmp = self.guessdicfn+'.tmp'
+        with open(tmp,'wb') as f:
+            pickle.dump(self.guessdic,f)
+        os.replace(tmp,self.guessdicfn)
+        if os.path.exists(self.guesslogfn): os.remove(self.guesslogfn)
+
+    def collect_guesses(self,num_workers=1,batch_size=100):
         #because the it takes so long collecting the guesses with big sets, like the
         # trade names, I am going to allow assembing these guesses BEFORE I am actually
         # manually doing the sorting.
-        cnt = -1
-        for term in self.wlst:
-            cnt += 1
-            # some values were initially misrecorded. This corrects them
-            if term in self.guessdic: 
-                if isinstance(self.guessdic[term],list) == True: continue
-            if len(term)<3 : continue
-            if term=='---' : continue
-            if term[0]=='/': continue
-            print(f'{cnt}. Working on guesses for {term}')
-            res = self.best_guess_scores_full(term,min_score=20)
-            print(f'Found {len(res)} matches, lowest score = {res[-1][1]}')
-            #pname = self.guessdir+self.colName+'_'+str(i)+'.pkl'
-            self.guessdic[term] = res
-            #with open(pname, 'wb') as f:
-            #    pickle.dump(res,f)
-            with open(self.guessdicfn,'wb') as f:
-                pickle.dump(self.guessdic,f)
+        """
+        `num_workers`: 1 (default) works through the terms in this process.
+        Larger values (or None for one per cpu) spread batches of
+        `batch_size` terms across a pool of processes.  Either way each
+        finished batch is appended to the guess log, and the guess dictionary
+        pickle is written once at the end.
+        """
+        os.makedirs(self.guessdir,exist_ok=True)
+        terms = [t for t in self.wlst if self._needs_guess(t)]
+        print(f'Collecting guesses for {len(terms)} of {len(self.wlst)} terms')
+        batches = [terms[i:i+batch_size] for i in range(0,len(terms),batch_size)]
+        done = 0
+        if (num_workers is None) or (num_workers>1):
+            with ProcessPoolExecutor(max_workers=num_workers,
+                                     initializer=_init_guess_worker,
+                                     initargs=(self.WORDS,)) as pool:
+                futures = [pool.submit(_guess_batch,b) for b in batches]
+                for fut in as_completed(futures):
+                    res = fut.result()
+                    self._append_guess_log(res)
+                    done += len(res)
+                    print(f'{done}/{len(terms)} terms done')
+        else:
+            for b in batches:
+                res = [(t,self.best_guess_scores_full(t,min_score=20)) for t in b]
+                self._append_guess_log(res)
+                done += len(res)
+                print(f'{done}/{len(terms)} terms done')
+        self._save_guessdic()
     
     def FormGroups(self):
         # start review display
         currIndex = 0
         currGroup = ''
         print(f'\n******* STARTING {self.colName} REVIEW  *********\n')
+        self.make_not_assigned_lst()
         while currIndex < len(self.wlst):
-            self.make_not_assigned_lst()
             print(f'Number of unique words processed: {currIndex}/{len(self.wlst)}')
             print(f'Percent of records still unassigned: {round(self.get_frac_not_assigned()*100,2)}%\n')
             tname = self.wlst[currIndex]
@@ -206,23 +299,20 @@ class Column_corrector():
                 nums = [str(x) for x in range(16)]
                 if keyp in nums:
                     keyi = int(keyp)
-                    self.res_dic[bgl[keyi][0]] = currGroup
-                    self.add_word_to_groups(currGroup,bgl[keyi][0])
+                    self.assign(bgl[keyi][0],currGroup)
                     
                 try: 
                     if keyp[0] == '[':
                         nlst = keyp[1:].split(',')
                         for n in nlst:
                             keyi = int(n)
-                            self.res_dic[bgl[keyi][0]] = currGroup
-                            self.add_word_to_groups(currGroup,bgl[keyi][0])
+                            self.assign(bgl[keyi][0],currGroup)
                 except:
                     print('Ill-formed list!!')
                 if keyp == 'ALL':
                     for num in nums:
                         keyi = int(num)
-                        self.res_dic[bgl[keyi][0]] = currGroup
-                        self.add_word_to_groups(currGroup,bgl[keyi][0])
+                        self.assign(bgl[keyi][0],currGroup)
                         
             if keyp == 'q':
                 break
@@ -275,8 +365,7 @@ class Column_corrector():
                 try:
                     lst = w.split(',')
                     if len(lst)>3:
-                        self.res_dic[w] = 'multiple types'
-                        self.add_word_to_groups('multiple types',w)
+                        self.assign(w,'multiple types')
                 except:
                     pass
                 
@@ -285,8 +374,7 @@ class Column_corrector():
         self.make_not_assigned_lst()
         for w in self.wlst:
             if self.is_not_assigned(w):
-                self.res_dic[w] = label
-                self.add_word_to_groups(label,w)
+                self.assign(w,label)
         
 
 if __name__ == '__main__':
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+The data-quality flags are kept in one integer column, 'DQ_flags', one bit
+per flag.  The older 'DQ_code' string is made from them; the flags are listed
+in the order they appear in that string.
+"""
+import numpy as np
+import pandas as pd
+
+EMPTY_EVENT     = 1<<0  # '1' event has no ingredient records
+DUP_EVENT       = 1<<1  # '2' duplicated event (same api10 and date)
+PERFECT_MATCH   = 1<<2  # 'P' CASNumber matches the CAS reference
+PROPRIETARY     = 1<<3  # '3' explicitly proprietary
+NONCAS_QUANT    = 1<<4  # '4' not CAS-like, but has a quantity
+NONCAS_NOQUANT  = 1<<5  # '5' not CAS-like, and no quantity
+REDUNDANT       = 1<<6  # 'R' redundant record (pdf conversion duplicate)
+PERC_IN_RANGE   = 1<<7  # '%' event total PercentHFJob within tolerance
+HAS_MASS        = 1<<8  # 'M' bgMass calculated
+PRES_ABS        = 1<<9  # 'A' usable for presence/absence
+
+flag_codes = [(EMPTY_EVENT,'1'),(DUP_EVENT,'2'),(PERFECT_MATCH,'P'),
+              (PROPRIETARY,'3'),(NONCAS_QUANT,'4'),(NONCAS_NOQUANT,'5'),
+              (REDUNDANT,'R'),(PERC_IN_RANGE,'%'),(HAS_MASS,'M'),
+              (PRES_ABS,'A')]
+code_bits = {c:bit for bit,c in flag_codes}
+flag_dtype = 'uint16'
+
+
+def init_flags(n):
+    """ a fresh, empty set of flags for `n` records"""
+    return np.zeros(n,dtype=flag_dtype)
+
+def set_flag(flags,cond,flag):
+    """ return `flags` with `flag` set wherever `cond` is True"""
+    flags = np.array(flags,dtype=flag_dtype)
+    flags[np.asarray(cond,dtype=bool)] |= flag
+    return flags
+
+def has_flag(flags,flag):
+    """ True where any of the bits in `flag` are set"""
+    return (np.asarray(flags) & flag)!=0
+
+def codes_to_bits(codes):
+    """ translate a DQ_code search pattern such as 'R|1|2' into a bitmask.
+    Returns None if the pattern is anything other than a simple alternation
+    of flag characters (callers then fall back to a regex search)."""
+    bits = 0
+    for c in codes.split('|'):
+        if c not in code_bits: return None
+        bits |= code_bits[c]
+    return bits
+
+def _flags_to_str(f):
+    s = '0'
+    for bit,c in flag_codes:
+        if f & bit: s += '-'+c
+    return s
+
+def to_DQ_code(flags):
+    """ the DQ_code string for each record.  Only the distinct flag values
+    (at most a few hundred) are converted."""
+    uni,inv = np.unique(np.asarray(flags),return_inverse=True)
+    labels = np.array([_flags_to_str(u) for u in uni],dtype=object)
+    return labels.take(inv)
+
+def from_DQ_code(dq_code):
+    """ flags recovered from DQ_code strings (e.g. from older pickles)"""
+    codes,uniques = pd.factorize(dq_code)
+    ubits = init_flags(len(uniques)+1) # last is for NaN (-1)
+    for i,u in enumerate(uniques):
+        for c in str(u):
+            ubits[i] |= code_bits.get(c,0)
+    return ubits.take(codes)
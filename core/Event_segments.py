@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Event_segments does per-event sums, counts and firsts over whole columns,
+without groupby, from an integer event code (0..n-1) for each record.
+"""
+import numpy as np
+
+
+class Event_segments():
+    def __init__(self,codes,n=None):
+        self.codes = np.asarray(codes,dtype='int64')
+        self.n = int(self.codes.max())+1 if n is None else n
+        self.order = np.argsort(self.codes,kind='stable')
+        scodes = self.codes[self.order]
+        self.starts = np.flatnonzero(np.r_[True,scodes[1:]!=scodes[:-1]]) \
+                      if len(scodes)>0 else np.zeros(0,dtype='int64')
+        self.seg_codes = scodes[self.starts] # the event of each segment
+        self.scodes = scodes
+
+    def _reduce(self,vals):
+        """ per-event sum of `vals` (already in record order)"""
+        out = np.zeros(self.n,dtype=vals.dtype)
+        if len(self.starts)>0:
+            out[self.seg_codes] = np.add.reduceat(vals[self.order],self.starts)
+        return out
+
+    def count(self,mask=None):
+        """ number of records (where `mask`) in each event"""
+        if mask is None: return np.bincount(self.codes,minlength=self.n)
+        return self._reduce(np.asarray(mask,dtype='int64'))
+
+    def sum(self,values,mask=None):
+        """ per-event sum of `values` over the records where `mask`, skipping
+        NaN (like groupby().sum())"""
+        vals = np.asarray(values,dtype='float64')
+        keep = ~np.isnan(vals)
+        if mask is not None: keep &= np.asarray(mask,dtype=bool)
+        return self._reduce(np.where(keep,vals,0.0))
+
+    def first(self,values,mask=None):
+        """ per-event first non-NaN of `values` over the records where `mask`
+        (like groupby().first()); NaN for events without any"""
+        vals = np.asarray(values,dtype='float64')[self.order]
+        keep = ~np.isnan(vals)
+        if mask is not None: keep &= np.asarray(mask,dtype=bool)[self.order]
+        pos = np.flatnonzero(keep)
+        ev,i = np.unique(self.scodes[pos],return_index=True)
+        out = np.full(self.n,np.NaN)
+        out[ev] = vals[pos[i]]
+        return out
+
+    def broadcast(self,per_event):
+        """ the value of each record's event"""
+        return np.asarray(per_event).take(self.codes)
@@ -28,7 +28,9 @@ class FF_stats():
         is, pandas assigns them to the wrong type when importing the raw.  """
         bools = ['FederalWell','IndianWell','IngredientMSDS']
         for b in bools:
-            self.df[b] = self.df[b].astype('bool')
+            # Read_FF now types these at import; only older pickles need it
+            if not pd.api.types.is_bool_dtype(self.df[b]):
+                self.df[b] = self.df[b].astype('bool')
         
     def _show_bool_col_stat(self):
         print('{:>25}: {:>12} {:>12}'.format('Field Name','% not empty',
@@ -37,7 +39,7 @@ class FF_stats():
         cols = list(self.df.columns)
         tot = len(self.df)
         for col in cols:
-            if self.df[col].dtype=='bool':
+            if pd.api.types.is_bool_dtype(self.df[col]):
                 perc_non_na = len(self.df[~self.df[col].isna()])/tot *100
                 perc_true = str(round(self.df[col].sum()/tot * 100,2))
                 print('{:>25}: {:>12} {:>12}'.format(col,
@@ -51,7 +53,8 @@ class FF_stats():
         cols = list(self.df.columns)
         tot = len(self.df)
         for col in cols:
-            if (self.df[col].dtype=='float64')|(self.df[col].dtype=='int64'):
+            if pd.api.types.is_numeric_dtype(self.df[col]) and \
+               not pd.api.types.is_bool_dtype(self.df[col]):
                 perc_non_na = len(self.df[~self.df[col].isna()])/tot *100
                 if perc_non_na >0:
                     non_zero = round(len(self.df[self.df[col]!=0])/tot * 100,2)
@@ -69,7 +72,7 @@ class FF_stats():
         tot = len(self.df)
         for col in cols:
             try:
-                if (self.df[col].dtype=='object'):
+                if (self.df[col].dtype=='object')|(str(self.df[col].dtype)=='category'):
                     perc_non_na = len(self.df[~self.df[col].isna()])/tot *100
                     if perc_non_na >0:
                         non_zero = round(len(self.df[~self.df[col].str.lower().str.strip().isin(self.na_lst)])/tot * 100,2)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Fuzzy_index gives the results of fuzzywuzzy's process.extract for a big
+list of strings that is searched over and over, scoring only the strings
+whose upper bound could reach the results.
+"""
+import heapq
+import numpy as np
+from fuzzywuzzy import fuzz, utils
+
+# character classes of processed strings: digits, letters, '_', ' ', other
+_lut = np.full(256,38,dtype='int64')
+_lut[ord('0'):ord('9')+1] = np.arange(10)
+_lut[ord('a'):ord('z')+1] = np.arange(10,36)
+_lut[ord('_')] = 36
+_lut[ord(' ')] = 37
+nchar = 39
+
+
+def process_choice(s):
+    """ the form process.extract compares for each choice"""
+    return utils.full_process(s,force_ascii=True)
+
+def process_query(s):
+    """ process.extract processes the query twice"""
+    return utils.full_process(utils.full_process(s),force_ascii=True)
+
+def _sorted_len(tokens):
+    """ length of the tokens joined by single spaces"""
+    return sum(len(t) for t in tokens) + max(len(tokens)-1,0)
+
+
+class Fuzzy_index():
+    def __init__(self,vocab=[]):
+        self.words = []   # original strings, by id
+        self.proc = []    # processed strings
+        self.tokset = []  # set of tokens
+        self.word_ids = {}   # string -> list of ids
+        self.postings = {}   # token -> set of ids
+        self.n = 0
+        self._alloc(max(len(vocab),16))
+        self.insert_many(vocab)
+
+    def _alloc(self,cap):
+        old = self.n
+        def grow(arr,shape,dtype):
+            new = np.zeros(shape,dtype=dtype)
+            if old>0: new[:old] = arr[:old]
+            return new
+        self.cap = cap
+        self.alive = grow(getattr(self,'alive',None),cap,bool)
+        self.counts = grow(getattr(self,'counts',None),(cap,nchar),'uint16')
+        self.plen = grow(getattr(self,'plen',None),cap,'int64') # processed
+        self.slen = grow(getattr(self,'slen',None),cap,'int64') # sorted tokens
+        self.ulen = grow(getattr(self,'ulen',None),cap,'int64') # unique tokens
+
+    def _char_counts(self,procs):
+        lens = np.array([len(p) for p in procs],dtype='int64')
+        b = np.frombuffer(''.join(procs).encode('ascii','replace'),dtype='uint8')
+        row = np.repeat(np.arange(len(procs)),lens)
+        cnt = np.bincount(row*nchar+_lut[b],minlength=len(procs)*nchar)
+        return cnt.reshape(len(procs),nchar), lens
+
+    def insert_many(self,words):
+        words = [str(w) for w in words]
+        if len(words)==0: return
+        if self.n+len(words) > self.cap:
+            self._alloc(max(2*self.cap,self.n+len(words)))
+        start = self.n
+        procs = [process_choice(w) for w in words]
+        cnt,lens = self._char_counts(procs)
+        ids = np.arange(start,start+len(words))
+        self.counts[ids] = np.minimum(cnt,65535)
+        self.plen[ids] = lens
+        self.alive[ids] = True
+        for i,w,p in zip(ids,words,procs):
+            toks = p.split()
+            tset = set(toks)
+            self.words.append(w)
+            self.proc.append(p)
+            self.tokset.append(tset)
+            self.slen[i] = _sorted_len(toks)
+            self.ulen[i] = _sorted_len(tset)
+            self.word_ids.setdefault(w,[]).append(i)
+            for t in tset:
+                self.postings.setdefault(t,set()).add(i)
+        self.n += len(words)
+
+    def insert(self,word):
+        self.insert_many([word])
+
+    def delete(self,word):
+        """ remove (all copies of) `word`; returns False if it isn't there"""
+        ids = self.word_ids.pop(str(word),[])
+        for i in ids:
+            self.alive[i] = False
+            for t in self.tokset[i]:
+                self.postings[t].discard(i)
+        return len(ids)>0
+
+    def __len__(self):
+        return int(self.alive[:self.n].sum())
+
+    def __contains__(self,word):
+        return str(word) in self.word_ids
+
+    def _bounds(self,pq,ids):
+        """ upper bound of the WRatio score of `pq` against each of `ids`"""
+        qc,_ = self._char_counts([pq])
+        qtok = pq.split()
+        qset = set(qtok)
+        La = len(pq); qs = _sorted_len(qtok); qu = _sorted_len(qset)
+        ov = np.minimum(self.counts[ids],qc[0]).sum(axis=1)
+        Lb = self.plen[ids]; sb = self.slen[ids]; ub = self.ulen[ids]
+        Lb_safe = np.maximum(Lb,1)
+        def r_full(la,lb): # bound of ratio
+            m = np.minimum(ov,np.minimum(la,lb))
+            return 2.0*m/np.maximum(la+lb,1)
+        def r_part(la,lb): # bound of partial_ratio
+            short = np.minimum(la,lb)
+            m = np.minimum(ov,short)
+            return 2.0*m/np.maximum(short+m,1)
+        def pct(r):
+            return np.rint(100*r)
+        len_ratio = np.maximum(La,Lb_safe)/np.minimum(La,Lb_safe)
+        try_partial = len_ratio>=1.5
+        ps = np.where(len_ratio>8,.6,.90)
+        base = pct(r_full(La,Lb))
+        partial = pct(r_part(La,Lb))*ps
+        ptsor = pct(r_part(qs,sb))*.95*ps
+        tsor = pct(r_full(qs,sb))*.95
+        # token set ratios; without shared tokens only the ratio of the
+        # joined unique tokens is left
+        ptser = pct(r_part(qu,ub))*.95*ps
+        tser = pct(r_full(qu,ub))*.95
+        shared = set()
+        for t in qset:
+            shared |= self.postings.get(t,set())
+        sh = np.fromiter(shared,dtype='int64')
+        pos = np.minimum(np.searchsorted(ids,sh),max(len(ids)-1,0))
+        pos = pos[ids[pos]==sh] if len(ids)>0 else pos[:0]
+        if len(pos)>0:
+            L0 = np.array([_sorted_len(qset & self.tokset[i]) for i in ids[pos]],
+                          dtype='int64')
+            # the sorted intersection starts both combined strings
+            r0 = np.maximum(2.0*L0/(L0+qu),2.0*L0/(L0+ub[pos]))
+            tser[pos] = np.maximum(tser[pos],pct(r0)*.95)
+            ptser[pos] = 100*.95*ps[pos]
+        bound = np.where(try_partial,
+                         np.maximum.reduce([base,partial,ptsor,ptser]),
+                         np.maximum.reduce([base,tsor,tser]))
+        bound = np.rint(bound)
+        bound[Lb==0] = 0
+        return bound
+
+    def extract(self,query,limit=5,score_cutoff=0):
+        """ the same as process.extractBests(query,vocab,score_cutoff=...,
+        limit=...) over the strings in the index: a list of (string, score),
+        best first."""
+        pq = process_query(query)
+        ids = np.flatnonzero(self.alive[:self.n])
+        if len(pq)==0: # every score is 0
+            if score_cutoff>0: return []
+            ids = ids if limit is None else ids[:limit]
+            return [(self.words[i],0) for i in ids]
+        bound = self._bounds(pq,ids)
+        order = np.lexsort((ids,-bound))
+        heap = [] # (score,-id); the worst result is heap[0]
+        for j in order:
+            b = bound[j]
+            if b<score_cutoff: break
+            if (limit is not None) and (len(heap)>=limit) and (b<heap[0][0]):
+                break
+            i = ids[j]
+            s = fuzz.WRatio(pq,self.proc[i],full_process=False)
+            if s<score_cutoff: continue
+            if (limit is None) or (len(heap)<limit):
+                heapq.heappush(heap,(s,-i))
+            elif (s,-i) > heap[0]:
+                heapq.heapreplace(heap,(s,-i))
+        res = sorted(heap,key=lambda x: (-x[0],-x[1]))
+        return [(self.words[-i],s) for s,i in res]
@@ -17,7 +17,28 @@ in the main dataframe. Working with the dictionary speeds up the process by >100
 
 import pandas as pd
 import numpy as np
-import csv, pickle
+import csv, pickle, os, shutil
+import core.DQ_flags as dq
+
+
+def shared_fingerprints(fp,df,cols,rows=None):
+    """ boolean array over the rows of df: True for rows whose 64-bit
+    fingerprint `fp` is also that of another row.  Only `rows` (positions)
+    are compared, if given.  Equal fingerprints are found by sorting, then
+    confirmed on the values of `cols` in case of a hash collision."""
+    idx = np.arange(len(fp)) if rows is None else np.asarray(rows)
+    f = fp[idx]
+    order = np.argsort(f,kind='stable')
+    same = f[order][1:]==f[order][:-1]
+    dup_sorted = np.zeros(len(idx),dtype=bool)
+    dup_sorted[1:] |= same
+    dup_sorted[:-1] |= same
+    dup = np.zeros(len(fp),dtype=bool)
+    dup[idx[order[dup_sorted]]] = True
+    cand = np.flatnonzero(dup)
+    exact = df[cols].iloc[cand].duplicated(keep=False).values
+    dup[cand[~exact]] = False
+    return dup
 
 
 class Parse_raw():
@@ -42,7 +63,11 @@ class Parse_raw():
         self.blank_label = '_empty_entry_'
         self.blank_list = ['CASNumber','IngredientName','OperatorName',
                            'Supplier','Purpose','TradeName','StateName']
-        self.field_dic_name = self.outdir+'field_dic_pickle.pkl'
+        self.field_dic_name = self.outdir+'field_dic_pickle.pkl' # older, single file
+        self.field_dic_dir = self.outdir+'field_dic/'
+        self.date_cache_fn = self.outdir+'date_cache.pkl'
+        self.event_index_fn = self.outdir+'event_index.pkl'
+        self.date_format = '%m/%d/%Y'
 
         
     def _adjust_API(self,row):
@@ -72,8 +97,14 @@ class Parse_raw():
         print('Normalizing empty cells')
         for col in self.blank_list:
             if col in df.columns:
-                df[col] = np.where(df[col].isin(self.blank_in),
-                                  self.blank_label,df[col])
+                if str(df[col].dtype)=='category':
+                    # keep categoricals as they are; just relabel the blanks
+                    if self.blank_label not in df[col].cat.categories:
+                        df[col] = df[col].cat.add_categories([self.blank_label])
+                    df[col] = df[col].fillna(self.blank_label)
+                else:
+                    df[col] = np.where(df[col].isin(self.blank_in),
+                                      self.blank_label,df[col])
         return df
     
     def _get_csv_df(self,fn):
@@ -85,79 +116,162 @@ class Parse_raw():
         """ save pd csv with heavy quoting """
         df.to_csv(fn,quotechar='$', quoting=csv.QUOTE_ALL)
     
-    def _update_field_categories(self,df_in):
-        col_names = ['CASNumber']
+    def _update_field_categories(self,df_in,col_names=None):
+        """ add the new values of each of the `col_names` fields (default: all
+        of the blank_list fields) to its *_field_cat.csv as 'not_classified'.
+        Membership is checked against a set of the known values and a file
+        is only rewritten when something new was found."""
+        if col_names is None: col_names = self.blank_list
         for col in col_names:
+            if col not in df_in.columns: continue
             fn = self.outdir+col+'_field_cat.csv'
             try:
                 fc = self._get_csv_df(fn)
+                # the index saved by _put_csv_df comes back as 'Unnamed: 0'
+                fc = fc.loc[:,~fc.columns.str.startswith('Unnamed')]
             except:
-                fc = pd.DataFrame()
+                fc = pd.DataFrame({'original':[],'clean':[],'bg':[]})
             print(f'Updating field categories for {col}, \n -- initial len: {len(fc)}')
-            curr_lst = list(fc.original.unique())
-            new_lst = list(df_in[col].unique())
-            update_lst = []
-            for item in new_lst:
-                if not item in curr_lst: # need to add it
-                    clean = item.strip().lower()
-                    update_lst.append({'original':item,'clean':clean,
-                                       'bg':'not_classified'})
+            # compare as strings; numeric-looking values are read back as numbers
+            curr = set(fc.original.astype('str'))
+            update_lst = [item for item in df_in[col].unique() 
+                          if str(item) not in curr]
             if len(update_lst)>0:
-                fc = fc.append(update_lst,sort=True,verify_integrity=True)
-            print(f' --   final len: {len(fc)}')
-            self._put_csv_df(fc,fn)
+                new = pd.DataFrame({'original':update_lst,
+                                    'clean':[str(item).strip().lower() for item in update_lst],
+                                    'bg':'not_classified'})
+                fc = pd.concat([fc,new],sort=True,ignore_index=True)
+                print(f' --   final len: {len(fc)}')
+                self._put_csv_df(fc,fn)
+            else:
+                print(' --   no new values')
 
     def get_field_cat(self,col_name='Supplier'):
         """ fetch the field_cat df for the col_name field."""
         fn = self.outdir+col_name+'_field_cat.csv'
         return self._get_csv_df(fn)        
 
-    def _createAPI10(self,raw_df):
+    def _make_api10(self,apinum,statenum,countynum):
+        """ vectorized version of _adjust_API: returns the api10 array and a
+        mask of the rows for which the adjustment failed (where _adjust_API
+        would print a warning).  As in _adjust_API, when the added leading
+        zero fixes the state but not the county, api10 is None.  A missing
+        APINumber gives a None api10 (and is not counted as a failure)."""
+        missing = pd.isna(pd.Series(apinum)).values
+        s = pd.Series(apinum).astype('str').reset_index(drop=True)
+        s0 = '0'+s
+        st = pd.Series(statenum).astype('float64').values
+        co = pd.Series(countynum).astype('float64').values
+        def part(t,start,end):
+            return pd.to_numeric(t.str[start:end],errors='coerce').values
+        normal = (part(s,0,2)==st) & (part(s,2,5)==co)
+        st0_ok = part(s0,0,2)==st
+        co0_ok = part(s0,2,5)==co
+        fixed = ~normal & st0_ok & co0_ok
+        no_match = ~normal & st0_ok & ~co0_ok
+        failed = ~normal & ~st0_ok & ~missing
+        api10 = np.where(fixed,s0.str[:10],s.str[:10])
+        api10[no_match|missing] = None
+        return api10, failed
+
+    def _event_api10(self,df,ev_codes):
+        """ api10 of each event, from the first APINumber, StateNumber and
+        CountyNumber of its rows in df (ev_codes gives the event of each
+        row)."""
         print('Creating api10')
-        api_df = raw_df.groupby('UploadKey',as_index=False)['APINumber',
-                                            'StateNumber','CountyNumber'].first()
-        api_df['api10'] = api_df.apply(lambda x: self._adjust_API(x),axis=1)
-        api_df = api_df[['UploadKey','api10']]
-        raw_df = pd.merge(raw_df,api_df,on='UploadKey',validate='m:1')
+        api_df = df[['APINumber','StateNumber','CountyNumber']].groupby(ev_codes).first()
+        api10,failed = self._make_api10(api_df.APINumber,api_df.StateNumber,
+                                        api_df.CountyNumber)
+        self.api10_failed = list(api_df[failed].APINumber)
+        if failed.sum()>0:
+            print(f'API10 adjustment failed for {failed.sum()} events')
+        return api10
+
+    def _createAPI10(self,raw_df):
+        ev_codes,_ = pd.factorize(raw_df.UploadKey)
+        raw_df['api10'] = self._event_api10(raw_df,ev_codes).take(ev_codes)
         return raw_df
 
-    def _make_date_field(self,raw_df):
-        print('Converting date')
+    def _parse_date_strings(self,strs):
+        """ parse raw JobEndDate strings to dates. The common FracFocus format
+        is parsed directly; anything else falls back to pandas' parser."""
         # drop the time portion of the datatime
-        raw_df['d1'] = raw_df.JobEndDate.str.split().str[0]
+        d = pd.Series(strs,dtype='object').str.split().str[0]
         # fix some obvious typos that cause system shutdown
-        raw_df['d2'] = raw_df.d1.str.replace('3012','2012')
-        # instead of translating ALL records, just do uniques records ...
-        tab = pd.DataFrame({'d2':list(raw_df.d2.unique())})
-        tab['date'] = pd.to_datetime(tab.d2)
-        # ... then merge back to whole data set
-        raw_df = pd.merge(raw_df,tab,on='d2',how='left',validate='m:1')
-        return raw_df.drop(['d1','d2'],axis=1)
+        d = d.str.replace('3012','2012',regex=False)
+        out = pd.to_datetime(d,format=self.date_format,errors='coerce')
+        rest = out.isna() & d.notna()
+        if rest.any():
+            out[rest] = pd.to_datetime(d[rest])
+        return out.values
+
+    def _get_date_cache(self):
+        try:
+            return pd.read_pickle(self.date_cache_fn)
+        except:
+            return pd.Series([],dtype='datetime64[ns]')
+
+    def _make_date_field(self,raw_df):
+        """ The translation from raw JobEndDate string to date is kept in a 
+        cache that carries over from build to build, so only strings never
+        seen before are parsed.  The dates are then applied to the whole
+        column through the codes of the unique strings."""
+        print('Converting date')
+        codes,uniques = pd.factorize(raw_df.JobEndDate)
+        cache = self._get_date_cache()
+        known = pd.Index(uniques).isin(cache.index)
+        if (~known).sum()>0:
+            print(f' -- parsing {(~known).sum()} new date strings')
+            new = pd.Series(self._parse_date_strings(uniques[~known]),
+                            index=uniques[~known])
+            cache = pd.concat([cache,new])
+            cache.to_pickle(self.date_cache_fn)
+        dates = cache.reindex(uniques).values
+        # NaT at the end for the missing JobEndDate (code -1)
+        dates = np.append(dates,np.datetime64('NaT'))
+        raw_df['date'] = dates.take(codes)
+        return raw_df
     
 # =============================================================================
 #     def _get_system_supplier(self,ev_df):
 #         return ev_df[ev_df.CASNumber=='Listed Below'].Supplier.value_counts().idxmax()
 # =============================================================================
     
+    def _system_approach_by_event(self,ev_codes,n_ev,cas,supplier):
+        """ the system approach flag and supplier guess for each of `n_ev`
+        events, given the event code, CASNumber and Supplier of each record.
+        This is done on integer codes for (event, Supplier): count each pair
+        once, then take the top pair of each event."""
+        sysrec = (np.asarray(cas,dtype=object)=='Listed Below')
+        sys_ev = ev_codes[sysrec]
+        sup_codes,sup_uni = pd.factorize(pd.Series(supplier)[sysrec])
+        # unique (event,supplier) pairs with their counts and first position
+        pairs = sys_ev.astype('int64')*(len(sup_uni)+1) + sup_codes
+        upairs,first,cnt = np.unique(pairs,return_index=True,return_counts=True)
+        pair_ev = sys_ev[first]
+        pair_sup = sup_codes[first]
+        # order by event, then most common, then first seen; keep the top one
+        order = np.lexsort((first,-cnt,pair_ev))
+        top = order[np.r_[True,pair_ev[order][1:]!=pair_ev[order][:-1]][:len(order)]]
+        
+        is_sys = np.zeros(n_ev,dtype=bool)
+        is_sys[pair_ev[top]] = True
+        guess = np.full(n_ev,'_not_system_',dtype=object)
+        guess[pair_ev[top]] = np.asarray(sup_uni,dtype=object).take(pair_sup[top])
+        return is_sys, guess
+    
     def _flag_system_approach(self,df):
-        """ find the records that have been entered using the System Approach"""
+        """ find the records that have been entered using the System Approach.
+        The most common Supplier among an event's 'Listed Below' records is 
+        taken as the system supplier guess (ties go to the Supplier seen 
+        first)."""
         print('Detecting "system approach"')
-        ulk = list(df[df.CASNumber=='Listed Below'].UploadKey.unique())
-        df['bgSystemApproach'] = df.UploadKey.isin(ulk)
-        gb = df[df.CASNumber=='Listed Below'].groupby('UploadKey',as_index=False)['Supplier'].agg(lambda x: x.value_counts().index[0])
-        #gb = df[df.CASNumber=='Listed Below'].groupby('UploadKey',as_index=False)['Supplier'].agg(pd.Series.mode)
-        gb.columns = ['UploadKey','sys_sup_guess']
-        #print(gb.head())
-# =============================================================================
-#         # Now get the System Supplier
-#         t = []
-#         for key in ulk:
-#             t.append(df[df.UploadKey==key].Supplier.value_counts().idxmax())
-#         tt = pd.DataFrame({'UploadKey':ulk,'bgSystemSupplier':t})
-# =============================================================================
-        df = pd.merge(df,gb,on='UploadKey',how='left',validate='m:1')
-        df.sys_sup_guess = np.where(df.sys_sup_guess.isna(),'_not_system_',
-                                       df.sys_sup_guess)
+        ev_codes,ev_uni = pd.factorize(df.UploadKey)
+        is_sys, guess = self._system_approach_by_event(ev_codes,len(ev_uni),
+                                                       df.CASNumber.values,
+                                                       df.Supplier.values)
+        df['bgSystemApproach'] = is_sys.take(ev_codes)
+        df['sys_sup_guess'] = guess.take(ev_codes)
         return df
     
     def cleanup(self,raw_df):
@@ -184,13 +298,12 @@ class Parse_raw():
         for removal 
         from the data set we use for analysis. Keeping them in the data set would
         distort any estimates of 'presence/absence' of materials."""
-        raw_df['DQ_code'] = '0' # initialize the 'disqualifying' code field.
-        raw_df.DQ_code = np.where(raw_df.IngredientKey.isna(),
-                                  raw_df.DQ_code.str[:]+'-1',
-                                      raw_df.DQ_code)
+        raw_df['DQ_flags'] = dq.init_flags(len(raw_df)) # the 'disqualifying' flags
+        raw_df['DQ_flags'] = dq.set_flag(raw_df.DQ_flags,raw_df.IngredientKey.isna(),
+                                         dq.EMPTY_EVENT)
         return raw_df
     
-    def _flag_duplicate_events(self,raw_df):
+    def _flag_duplicate_events(self,raw_df,ev=None,ev_codes=None):
         """The FracFocus data set contains multiple versions of some fracking events.
         Here we first find the duplicates (using the API number and the fracking date).
         NOTE:  For this version of the FF database, we mark ALL duplicates for removal.
@@ -202,94 +315,283 @@ class Parse_raw():
         find the most correct way to salvage the duplicates.  Because we are
         not keeping FFV1's anyway, this decision results in the loss of about 2%
         of all events.
+        
+        The events are compared through the event index (see
+        _make_event_index): the fingerprints of the eligible events are sorted
+        and equal neighbors are duplicates.  The index is saved for later
+        analysis (_get_duplicate_events).  It is made here unless given, with
+        the event code of each record, as `ev` and `ev_codes`.
         """
-        t = raw_df[raw_df.DQ_code=='0'][['UploadKey','date','api10','ingkey']].copy()
-        t = t.groupby(['UploadKey','date','api10'],as_index=False)['ingkey','UploadKey'].first()
-        t = t.sort_values(by='ingkey')
-        t['dupes'] = t.duplicated(subset=['api10','date'],keep=False)
-        # if keeping the highest ingkey event, use the following line instead
-#        t['dupes'] = t.duplicated(subset=['api10','date'],keep='last')
-
-        dupes = list(t[t.dupes].UploadKey.unique())
-        raw_df.DQ_code = np.where(raw_df.UploadKey.isin(dupes),
-                                  raw_df.DQ_code.str[:]+'-2',
-                                  raw_df.DQ_code)
+        if ev is None:
+            ev, ev_codes = self._get_event_index(raw_df,rebuild=True)
+        else:
+            ev.to_pickle(self.event_index_fn)
+        # only events with some non-empty records, and with a date and api10
+        eligible = np.zeros(len(ev),dtype=bool)
+        eligible[ev_codes[raw_df.DQ_flags.values==0]] = True
+        eligible &= (ev.date.notna() & ev.api10.notna()).values
+        dup_ev = self._find_duplicate_fingerprints(ev,eligible)
+        raw_df['DQ_flags'] = dq.set_flag(raw_df.DQ_flags,dup_ev.take(ev_codes),
+                                         dq.DUP_EVENT)
         return raw_df
     
-# =============================================================================
-#     def _get_duplicate_events(self,raw_df, ignore_FF1=True):
-#         """We use this method to fetch a set of all the events that are duplicates 
-#         (by api and date), so we may test how they are different.
-#         """
-#         
-#         t = raw_df[['UploadKey','date','api10','ingkey']].copy()
-#         t = t.groupby(['UploadKey','date','api10'],as_index=False)['ingkey','UploadKey'].first()
-#         t['dupes'] = t.duplicated(subset=['api10','date'],keep=False)
-#         #print(f'Number of dupes = {t.dupes.sum()}')
-#         dupes = list(t[t.dupes].UploadKey.unique())
-#         dupe_df = raw_df[raw_df.UploadKey.isin(dupes)].copy()
-#         gb = dupe_df.groupby(['UploadKey','api10','date'],as_index=False)['bgMass'].count()
-#         gb2 = gb.groupby(['api10','date'],as_index=False)['UploadKey'].count()
-#         gb2['dup_cnt'] = gb2.index
-#         return pd.merge(dupe_df,gb2[['api10','date','dup_cnt']],on=['api10','date'],
-#                            how='left')
-# 
-# =============================================================================
+    def _event_index(self,uploadkey,ingkey,api10,date):
+        """ the event index from per-event arrays: a 64-bit fingerprint of
+        (api10, date) is added."""
+        ev = pd.DataFrame({'UploadKey':uploadkey,'ingkey':ingkey,
+                           'api10':api10,'date':date})
+        ev['fingerprint'] = pd.util.hash_pandas_object(ev[['api10','date']],
+                                                       index=False).values
+        return ev
 
-    def clean_events(self,raw_df):
+    def _make_event_index(self,raw_df):
+        """ one row per event with its first ingkey, api10, date and a 64-bit
+        fingerprint of (api10, date).  Returns the index and the event code
+        (row of the index) of every record."""
+        ev_codes,ev_uni = pd.factorize(raw_df.UploadKey)
+        # codes are in order of first appearance, so this is the first record
+        _,first = np.unique(ev_codes,return_index=True)
+        ev = self._event_index(ev_uni,raw_df.ingkey.values[first],
+                               raw_df.api10.values[first],
+                               raw_df.date.values[first])
+        return ev, ev_codes
+
+    def _get_event_index(self,raw_df,rebuild=False):
+        """ fetch the event index saved by an earlier call when it covers the
+        events of raw_df, otherwise make (and save) a new one."""
+        try:
+            if rebuild: raise FileNotFoundError
+            ev = pd.read_pickle(self.event_index_fn)
+            ev_codes = pd.Index(ev.UploadKey).get_indexer(raw_df.UploadKey)
+            if (len(ev)==len(raw_df.UploadKey.unique())) & (ev_codes.min()>=0):
+                return ev, ev_codes
+        except:
+            pass
+        print('Making event index')
+        ev, ev_codes = self._make_event_index(raw_df)
+        ev.to_pickle(self.event_index_fn)
+        return ev, ev_codes
+
+    def _find_duplicate_fingerprints(self,ev,eligible):
+        """ boolean array over the events of `ev`: True for eligible events
+        whose fingerprint is shared with another eligible event."""
+        return shared_fingerprints(ev.fingerprint.values,ev,['api10','date'],
+                                   rows=np.flatnonzero(eligible))
+    
+    def _get_duplicate_events(self,raw_df, ignore_FF1=True):
+        """We use this method to fetch a set of all the events that are duplicates 
+        (by api and date), so we may test how they are different. 'dup_cnt'
+        numbers the sets of duplicates.  Uses the saved event index when
+        it matches raw_df.
+        """
+        ev, ev_codes = self._get_event_index(raw_df)
+        eligible = (ev.date.notna() & ev.api10.notna()).values
+        dup_ev = self._find_duplicate_fingerprints(ev,eligible)
+        dups = ev[dup_ev].copy()
+        dups['dup_cnt'] = dups.groupby(['api10','date']).ngroup()
+        dup_cnt = np.full(len(ev),-1)
+        dup_cnt[np.flatnonzero(dup_ev)] = dups.dup_cnt.values
+        rec = dup_ev.take(ev_codes)
+        dupe_df = raw_df[rec].copy()
+        dupe_df['dup_cnt'] = dup_cnt.take(ev_codes[rec])
+        return dupe_df
+
+    def clean_events(self,raw_df,ev=None,ev_codes=None):
+        """ flag the empty and duplicate events.  `ev` and `ev_codes` are
+        passed on to _flag_duplicate_events."""
         raw_df = self._flag_empty_events(raw_df)
-        raw_df = self._flag_duplicate_events(raw_df)
-        empty_ev = list(raw_df[raw_df.DQ_code.str.contains('1',regex=False)].UploadKey.unique())
-        dup_ev = list(raw_df[raw_df.DQ_code.str.contains('2',regex=False)].UploadKey.unique())
+        raw_df = self._flag_duplicate_events(raw_df,ev,ev_codes)
+        if ev_codes is None:
+            ev_codes,_ = pd.factorize(raw_df.UploadKey)
+        flags = raw_df.DQ_flags.values
+        empty_ev = np.unique(ev_codes[dq.has_flag(flags,dq.EMPTY_EVENT)])
+        dup_ev = np.unique(ev_codes[dq.has_flag(flags,dq.DUP_EVENT)])
         print(f'Removed events: empty: {len(empty_ev)}, duplicate: {len(dup_ev)}')
         return raw_df
 
-    def make_field_dict(self,raw_df):
-        # used as precursor to find unique categories in important fields
-        cols = ['Supplier','CASNumber','IngredientName','StateName',
-                'Purpose','UploadKey','OperatorName','TradeName']
-#        multi = {'casig':['CASNumber','IngredientName']}
-                 #'trade_casig':['TradeName','CASNumber','IngredientName']}
-        df = raw_df[cols].copy()
-        raw_df = None
+### Star-schema mode: an event table and an ingredient table
+    def _constant_in_events(self,ser,ev_codes,first):
+        """ True when every record of each event has the value of its
+        event's first record (missing values count as equal)."""
+        codes,_ = pd.factorize(ser)
+        return (codes==codes[first].take(ev_codes)).all()
 
-        # replace blank_in with blank_label  !!! is this necessary??
-        for col in cols:
-            df[col] = np.where(df[col].isin(self.blank_in),self.blank_label,df[col])
-        dic = {}
-        for col in cols:
-            t = pd.DataFrame(df[[col]])#,columns=['original'])
-            if col in ['UploadKey']: # don't 'clean' these
-                t['clean'] = t[col]#t.original
+    def split_tables(self,raw_df):
+        """ split the flat raw_df into an event table, one row per UploadKey 
+        with the event and well fields, and an ingredient table with 
+        everything else.  'evkey' joins the two; it is the row number of the 
+        event table.  Event-level work then runs on ~150k rows instead of 
+        the ~4M ingredient records.
+        
+        An event or well field whose value is not the same for all the
+        records of an event (e.g. FFVersion, StateName or TVD in some
+        events) stays on the ingredient table, so that the join gives back
+        every record's own value."""
+        print('Splitting into event and ingredient tables')
+        self.raw_cols = list(raw_df.columns)
+        ev_codes,ev_uni = pd.factorize(raw_df.UploadKey)
+        # codes are in order of first appearance, so this is the first record
+        _,first = np.unique(ev_codes,return_index=True)
+        ev_cols = ['UploadKey']
+        rec_cols = []
+        for c in self.ev_list+self.well_list:
+            if (c not in raw_df.columns) or (c in ev_cols): continue
+            if self._constant_in_events(raw_df[c],ev_codes,first):
+                ev_cols.append(c)
             else:
-                t['clean'] = t[col].astype('str').str.strip().str.lower()
-                
-            # after cleanup, some may become 'empty' (were just extraneous char)
-            t.clean = np.where(t.clean.isin(self.blank_in),self.blank_label,t.clean)
+                rec_cols.append(c)
+        if len(rec_cols)>0:
+            print(f' -- not constant within events, kept on the records: {rec_cols}')
+        ev_df = raw_df[ev_cols].iloc[first].reset_index(drop=True)
+        ev_df['evkey'] = np.arange(len(ev_df))
+        ing_df = raw_df.drop(ev_cols,axis=1)
+        ing_df['evkey'] = ev_codes
+        print(f' -- events: {len(ev_df)}, ingredient records: {len(ing_df)}')
+        return ev_df, ing_df
+    
+    def join_tables(self,ev_df,ing_df,col_order=[]):
+        """ the flat view: one row per ingredient record with its event 
+        fields.  The raw columns come first in their original order, then
+        those of `col_order` (e.g. the order in which the flat processing
+        adds them), then any others."""
+        evkey = ing_df.evkey.values
+        ev_part = ev_df.drop('evkey',axis=1).iloc[evkey].reset_index(drop=True)
+        ing_part = ing_df.drop('evkey',axis=1).reset_index(drop=True)
+        flat = pd.concat([ev_part,ing_part],axis=1)
+        order = []
+        for c in getattr(self,'raw_cols',[])+list(col_order)+list(flat.columns):
+            if (c in flat.columns) and (c not in order): order.append(c)
+        return flat[order]
+    
+    def _table_cols(self,ev_df,ing_df,cols):
+        """ `cols` from the event table when it has all of them (one row per
+        event), otherwise over the ingredient records (with the event fields
+        sent to them by evkey).  Returns the frame and the event code of
+        each of its rows."""
+        if all(c in ev_df.columns for c in cols):
+            return ev_df[cols], ev_df.evkey.values
+        evkey = ing_df.evkey.values
+        df = pd.DataFrame({c:(ing_df[c].values if c in ing_df.columns
+                              else ev_df[c].take(evkey).values) for c in cols})
+        return df, evkey
 
-            gb = t.groupby('clean',as_index=False)[col].count()
-            gb.columns = ['clean','cnt']
-            dic[col] = gb
-            print(f'Number of unique {col}: {len(dic[col])}')
-        #t = dic['IngredientName']
-# =============================================================================
-#         for m in multi.keys():
-#             t = pd.DataFrame(df[multi[m]])
-#             for col in multi[m]:
-#                 t[col] = t[col].astype('str').str.strip().str.lower() 
-#                 # after cleanup, some may become 'empty' (were just extraneous char)
-#                 t[col] = np.where(t[col].isin(self.blank_in),self.blank_label,t[col])
-#             t['cnt'] = t[multi[m][0]] # this is a dummy var to aid in counts
-#             gb = t.groupby(multi[m],as_index=False)['cnt'].count()
-#             dic[m] = gb
-#             print(f'Number of unique {m}: {len(dic[m])}')
-# 
-# =============================================================================
-        with open(self.field_dic_name,'wb') as f:
-            pickle.dump(dic,f)
+    def _event_values(self,ev_df,ing_df,col,first):
+        """ the value of `col` for each event: from the event table, or
+        that of the event's first record"""
+        if col in ev_df.columns: return ev_df[col].values
+        return ing_df[col].values[first]
+
+    def cleanup_tables(self,ev_df,ing_df):
+        """ cleanup() for the split tables"""
+        ev_df = self._normalize_empty_cells(ev_df)
+        ing_df = self._normalize_empty_cells(ing_df)
+        api_df,codes = self._table_cols(ev_df,ing_df,['APINumber','StateNumber',
+                                                      'CountyNumber'])
+        ev_df['api10'] = self._event_api10(api_df,codes)
+        # the date goes where JobEndDate is
+        if 'JobEndDate' in ev_df.columns:
+            ev_df = self._make_date_field(ev_df)
+        else:
+            ing_df = self._make_date_field(ing_df)
+        print('Detecting "system approach"')
+        ev_df['bgSystemApproach'],ev_df['sys_sup_guess'] = \
+            self._system_approach_by_event(ing_df.evkey.values,len(ev_df),
+                                           ing_df.CASNumber.values,
+                                           ing_df.Supplier.values)
+        self._update_field_categories(ev_df)
+        self._update_field_categories(ing_df)
+        return ev_df, ing_df
+    
+    def clean_events_tables(self,ev_df,ing_df):
+        """ clean_events() for the split tables; the flags are kept on the
+        ingredient records."""
+        ev_codes = ing_df.evkey.values
+        _,first = np.unique(ev_codes,return_index=True)
+        ev = self._event_index(ev_df.UploadKey.values,ing_df.ingkey.values[first],
+                               ev_df.api10.values,
+                               self._event_values(ev_df,ing_df,'date',first))
+        return self.clean_events(ing_df,ev,ev_codes)
+
+    def _clean_field_codes(self,ser,clean=True):
+        """ factorize `ser` and clean only its unique values.  Returns the
+        code of the cleaned value for every unique raw value (the last one is
+        for the missing values, code -1), the cleaned values and the number of
+        records of each raw value (same order as the first array)."""
+        codes,uniques = pd.factorize(ser)
+        u = pd.Series(np.asarray(uniques,dtype=object))
+        u = u.where(~u.isin(self.blank_in),self.blank_label)
+        if clean:
+            u = u.astype('str').str.strip().str.lower()
+        # after cleanup, some may become 'empty' (were just extraneous char)
+        u = u.where(~u.isin(self.blank_in),self.blank_label)
+        u = pd.concat([u,pd.Series([self.blank_label])],ignore_index=True)
+        ucodes,clean_uni = pd.factorize(u)
+        raw_cnt = np.bincount(np.where(codes<0,len(uniques),codes),
+                              minlength=len(u))
+        return ucodes, np.asarray(clean_uni,dtype=object), raw_cnt, codes
+
+    def make_field_dict(self,raw_df,
+                        cols = ['Supplier','CASNumber','IngredientName','StateName',
+                                'Purpose','UploadKey','OperatorName','TradeName'],
+                        multi = {'casig':['CASNumber','IngredientName']}):
+                                 #'trade_casig':['TradeName','CASNumber','IngredientName']}
+        """ used as precursor to find unique categories in important fields.
+        For each of `cols` (and each combination in `multi`) the dictionary
+        has the cleaned values and their record counts.  Each column is 
+        factorized once; only the uniques are cleaned and the counting is 
+        done on the integer codes.  Each entry is saved to its own file (see
+        get_field_dict_entry)."""
+        dic = {}
+        rec_codes = {}
+        for col in cols+[c for m in multi.values() for c in m if c not in cols]:
+            # don't 'clean' UploadKey
+            ucodes,clean_uni,raw_cnt,codes = self._clean_field_codes(raw_df[col],
+                                                  clean=col not in ['UploadKey'])
+            if col in cols:
+                cnt = np.bincount(ucodes,weights=raw_cnt,minlength=len(clean_uni))
+                gb = pd.DataFrame({'clean':clean_uni,'cnt':cnt.astype('int64')})
+                gb = gb[gb.cnt>0].sort_values('clean').reset_index(drop=True)
+                dic[col] = gb
+                print(f'Number of unique {col}: {len(dic[col])}')
+            if any(col in m for m in multi.values()):
+                rec_codes[col] = (ucodes.take(codes),clean_uni)
+        
+        for m in multi.keys():
+            # a single integer code for each combination of the cleaned values
+            key = np.zeros(len(raw_df),dtype='int64')
+            for col in multi[m]:
+                c,uni = rec_codes[col]
+                key = key*len(uni) + c
+            ukey,first,cnt = np.unique(key,return_index=True,return_counts=True)
+            gb = pd.DataFrame({col:rec_codes[col][1].take(rec_codes[col][0][first])
+                               for col in multi[m]})
+            gb['cnt'] = cnt
+            dic[m] = gb.sort_values(multi[m]).reset_index(drop=True)
+            print(f'Number of unique {m}: {len(dic[m])}')
+
+        self._save_field_dict(dic)
+
+    def _save_field_dict(self,dic):
+        if os.path.exists(self.field_dic_dir): shutil.rmtree(self.field_dic_dir)
+        os.makedirs(self.field_dic_dir)
+        for name in dic.keys():
+            dic[name].to_pickle(self.field_dic_dir+name+'.pkl')
+
+    def get_field_dict_entry(self,name):
+        """load a single entry of the field_dic (a column name or a 
+        multi-key name such as 'casig') without reading the others"""
+        fn = self.field_dic_dir+name+'.pkl'
+        if os.path.exists(fn): return pd.read_pickle(fn)
+        return self.get_field_dict()[name]
 
     def get_field_dict(self):
-        """load the field_dic from its pickle"""
-        with open(self.field_dic_name,'rb') as f:
-            return pickle.load(f)
-    
\ No newline at end of file
+        """load the whole field_dic; from the older single pickle if the
+        per-entry files have not been made"""
+        if not os.path.exists(self.field_dic_dir):
+            with open(self.field_dic_name,'rb') as f:
+                return pickle.load(f)
+        dic = {}
+        for fn in sorted(os.listdir(self.field_dic_dir)):
+            if fn.endswith('.pkl'):
+                dic[fn[:-4]] = pd.read_pickle(self.field_dic_dir+fn)
+        return dic
@@ -3,40 +3,163 @@
 Created on Wed Jul  3 16:52:41 2019
 
 @author: Gary Allison
+
+The mass calculation depends on a few tolerances (`default_params`).  The
+per-event quantities that don't depend on them (total PercentHFJob, the
+water volume, the candidate carrier records) are kept in `Process_mass.cache`
+and can be saved; `sweep` then recomputes bgMass and the '%', 'M' and 'A'
+flags for any number of parameter sets from the cache alone, without
+running the pipeline again.
 """
 
 import numpy as np
 import pandas as pd
+import core.DQ_flags as dq
+import core.Event_segments as es
+import core.Value_classes as vc
+
+default_params = {'perc_low':95,     # an event's total PercentHFJob must be
+                  'perc_high':105,   # within these for its masses ('%')
+                  'carrier_min':50,  # the carrier must be more than this % of the job
+                  'lbs_per_gal':8.3} # to convert the carrier volume to lbs
+
+# the flags that depend on the parameters
+mass_flags = dq.PERC_IN_RANGE|dq.HAS_MASS|dq.PRES_ABS
+
+
+def _full_params(param_sets):
+    return pd.DataFrame([dict(default_params,**p) for p in param_sets],
+                        columns=list(default_params.keys()))
+
+def _event_results(cache,param_sets):
+    """ for each parameter set (rows) and event (columns): whether the total
+    percent is within tolerance, whether the carrier is within range, the
+    total mass of the job and whether the event has totals at all"""
+    ps = _full_params(param_sets)
+    def col(c): return ps[c].values.astype('float64')[:,None]
+    tot = cache['tot_perc'][None,:]
+    within_tol = cache['has_rec'][None,:] & (tot<=col('perc_high')) & (tot>=col('perc_low'))
+    in_range = within_tol & cache['has_ok'][None,:]
+    # percent of the job that is the carrier: the carrier records plus the
+    # water records that are more than carrier_min on their own
+    cseg = es.Event_segments(cache['cand_codes'],len(cache['tot_perc']))
+    carrier_perc = np.full(in_range.shape,np.NaN)
+    for cut in ps.carrier_min.unique():
+        rows = (ps.carrier_min==cut).values
+        sel = cache['cand_is_carrier'] | (cache['cand_perc']>cut)
+        has_carrier = cseg.count(sel)>0
+        carrier_perc[rows] = np.where(in_range[rows] & has_carrier,
+                                      cseg.sum(cache['cand_perc'],sel),np.NaN)
+    water = np.where(in_range,cache['water'][None,:],np.NaN)
+    carrier_mass = water * col('lbs_per_gal')  # reporting in lbs
+    with np.errstate(divide='ignore',invalid='ignore'):
+        total_mass = carrier_mass/(carrier_perc/100)
+    # limit to within reasonable range of 'carrier_mass'
+    tot_wi_range = (carrier_perc>col('carrier_min')) & (carrier_perc<=100)
+    return within_tol, tot_wi_range, total_mass, in_range
+
+def _record_results(cache,within_tol,tot_wi_range,total_mass,in_range):
+    """ bgMass and DQ_flags of each record for each parameter set"""
+    codes = cache['codes']
+    perc = cache['perc']
+    twr = tot_wi_range[:,codes]
+    with np.errstate(invalid='ignore'):
+        bgMass = np.where(twr,(perc/100)*total_mass[:,codes],np.NaN)
+    flags = np.repeat(cache['flags'][None,:],len(twr),axis=0)
+    flags = dq.set_flag(flags,within_tol[:,codes],dq.PERC_IN_RANGE)
+    flags = dq.set_flag(flags,twr&(perc>0),dq.HAS_MASS)
+    # events without totals had a NaN tot_wi_range, which is taken as True
+    flags = dq.set_flag(flags,twr|~in_range[:,codes],dq.PRES_ABS)
+    return bgMass, flags
+
+def sweep(cache,param_sets):
+    """ recompute the masses for each of `param_sets` (a list of dicts with
+    any of the keys of default_params).  Returns a dict of the full
+    parameter sets (a df) and 'bgMass' and 'DQ_flags' arrays with one row
+    per set and one column per record, in the order of the records the
+    cache was made from."""
+    bgMass, flags = _record_results(cache,*_event_results(cache,param_sets))
+    return {'params':_full_params(param_sets),'bgMass':bgMass,'DQ_flags':flags}
+
+def save_cache(cache,fn):
+    np.savez(fn,**cache)
+
+def load_cache(fn):
+    with np.load(fn) as f:
+        return {k:f[k] for k in f.files}
+
 
 class Process_mass():
     """The methods of this class are used to calculate implied measures of
-    mass of chemicals and other related tasks."""
+    mass of chemicals and other related tasks.
+    
+    Events are given integer codes once; all the per-event totals are then
+    computed with Event_segments over whole columns and sent back to the
+    records by code.
+    
+    With `ev_df` (the event table of Parse_raw.split_tables), `df` is the
+    ingredient table: events are then keyed by 'evkey' and the per-event 
+    totals are kept on `self.ev_df`.
     
-    def __init__(self, df):
+    `params` overrides any of the `default_params`.
+    `classes` is the Value_classes used for the Purpose and IngredientName
+    tests (by default, a new one that is not saved)."""
+    
+    def __init__(self, df, ev_df=None, params={}, classes=None):
         self.df = df
-        # now use DQ_code to find records that are workable
+        self.ev_df = ev_df
+        self.params = dict(default_params,**params)
+        self.classes = vc.Value_classes() if classes is None else classes
+        self.key = 'UploadKey' if ev_df is None else 'evkey'
+        if ev_df is None:
+            codes,_ = pd.factorize(self.df.UploadKey)
+            self.seg = es.Event_segments(codes)
+        else:
+            self.seg = es.Event_segments(self.df.evkey.values,len(ev_df))
+        # now use DQ_flags to find records that are workable
         print('Starting the Process_mass phase')
-        self.df['ok'] = self.df.DQ_code.str.contains('P|3') # perfect match or proprietary
-        self.df.ok = np.where(self.df.DQ_code.str.contains('R|1|2|4|5'),
-                              False,self.df.ok)
-        self.df['no_redund'] = ~self.df.DQ_code.str.contains('R')
-        print(f'Num events: {len(self.df[self.df.ok].UploadKey.unique())}')
-        print(f'Total records: {len(self.df[self.df.ok])}')
+        flags = self.df.DQ_flags
+        self.df['ok'] = dq.has_flag(flags,dq.PERFECT_MATCH|dq.PROPRIETARY) & \
+                        ~dq.has_flag(flags,dq.REDUNDANT|dq.EMPTY_EVENT|dq.DUP_EVENT|
+                                     dq.NONCAS_QUANT|dq.NONCAS_NOQUANT)
+        self.df['no_redund'] = ~dq.has_flag(flags,dq.REDUNDANT)
+        print(f'Num events: {(self.seg.count(self.df.ok.values)>0).sum()}')
+        print(f'Total records: {self.df.ok.sum()}')
         
+    def _make_cache(self):
+        """ the parts of the mass calculation that don't depend on params"""
+        perc = self.df.PercentHFJob.values.astype('float64')
+        no_redund = self.df.no_redund.values
+        ok = self.df.ok.values
+        name = self.classes.lookup(self.df.IngredientName,'IngredientName')
+        is_water = (self.df.bgCAS=='7732-18-5').values | name['is_water'] \
+                   | name['is_h2o']
+        is_carrier = self.df.is_carrier.values
+        cand = no_redund & (is_carrier | is_water)
+        if 'TotalBaseWaterVolume' in self.df.columns:
+            water = self.seg.first(self.df.TotalBaseWaterVolume.values,ok)
+        else: # the water volume is already one per event
+            water = self.ev_df.TotalBaseWaterVolume.values.astype('float64')
+        self.cache = {# per event
+                      'tot_perc':self.seg.sum(perc,no_redund),
+                      'has_rec':self.seg.count(no_redund)>0,
+                      'has_ok':self.seg.count(ok)>0,
+                      'water':water,
+                      # the records that may be the carrier
+                      'cand_codes':self.seg.codes[cand],
+                      'cand_perc':perc[cand],
+                      'cand_is_carrier':is_carrier[cand],
+                      # per record
+                      'codes':self.seg.codes,
+                      'perc':perc,
+                      'flags':np.asarray(self.df.DQ_flags) & ~np.uint16(mass_flags)}
+
     def _total_percent_within_range(self):
-        # remove these from calculations
-        cnd1 = ~self.df.DQ_code.str.contains('R')
-        gb = self.df[cnd1].groupby('UploadKey', as_index=False)['PercentHFJob'].sum()
-        cnts = pd.cut(gb.PercentHFJob,[0,1,10,90,95,105,110,10000])
+        has_rec = self.cache['has_rec']
+        cnts = pd.cut(pd.Series(self.cache['tot_perc'][has_rec]),
+                      [0,1,10,90,95,105,110,10000])
         print('Range of total % for "all" events')
         print(pd.value_counts(cnts))        
-        cl = gb.PercentHFJob<=105
-        ch = gb.PercentHFJob>=95
-        #gb['within_tol'] = cl&ch
-        ulist = list(gb[cl&ch].UploadKey.unique()) # all events within tolerance
-        self.df.DQ_code = np.where(self.df.UploadKey.isin(ulist),
-                                   self.df.DQ_code.str[:]+'-%',
-                                   self.df.DQ_code)
         
         
     def _get_carrier_names(self):
@@ -47,53 +170,49 @@ class Process_mass():
         search for all the purpose categories that match.  However, those events that
         cram multiple purposes into a single cell have to be controlled for.  Because
         these multi-component purpose categories are long strings, we limit the
-        length of the strings that are allowed in this list."""
+        length of the strings that are allowed in this list (see 
+        Value_classes)."""
         
-        cn = pd.DataFrame({'Purpose':list(self.df.Purpose.unique())})
-        cn['clean'] = cn.Purpose.str.strip().str.lower()
-        cn['is_base'] = cn.clean.str.contains('base',regex=False)
-        cn['is_carrier'] = cn.clean.str.contains('carrier',regex=False) | cn.is_base
-        cn['is_short'] = cn.clean.str.len()<50
-        cn.is_carrier = cn.is_carrier&cn.is_short
-        self.df = pd.merge(self.df,cn[['Purpose','is_carrier']],on='Purpose',how='left')
+        self.df['is_carrier'] = self.classes.lookup(self.df.Purpose,
+                                                    'Purpose')['is_carrier']
         
     def _get_total_event_mass(self):
-        cnd1 = self.df.DQ_code.str.contains('%',regex=False)
-        cnd2 = (self.df.PercentHFJob>50) & \
-               ((self.df.bgCAS=='7732-18-5') \
-                |(self.df.IngredientName.str.lower().str.contains('water',regex=False)) \
-                |(self.df.IngredientName.str.lower().str.contains('h2o',regex=False)))
-        cnd3 = self.df.is_carrier
-        gb1 = self.df[self.df.ok & cnd1].groupby('UploadKey',as_index=False)['TotalBaseWaterVolume'].first()
-        gb2 = self.df[self.df.no_redund & cnd1 & (cnd2 | cnd3)].groupby('UploadKey',as_index=False)['PercentHFJob'].sum()
-        #print(gb1.columns, gb2.columns)
-        mg = pd.merge(gb1,gb2,on='UploadKey',how='left')
-        mg['carrier_mass'] = mg.TotalBaseWaterVolume * 8.3  # reporting in lbs
-        mg['total_mass'] = mg.carrier_mass/(mg.PercentHFJob/100)
-        return mg
+        """ the per-event totals for self.params, one row per event code"""
+        res = _event_results(self.cache,[self.params])
+        tot_wi_range = res[1][0].astype(object)
+        tot_wi_range[~res[3][0]] = np.NaN # events without totals
+        return pd.DataFrame({'within_tol':res[0][0],'tot_wi_range':tot_wi_range,
+                             'total_mass':res[2][0],'in_range':res[3][0]})
     
     def _calc_all_record_masses(self,totaldf):
-        """apply 'M' to all filtered records that have mass and 'A' to all filtered
-        records that have pres/abs.
+        """apply '%' to the records of events within tolerance, 'M' to all 
+        filtered records that have mass and 'A' to all filtered records that 
+        have pres/abs.
         """
-        # first limit to within reasonable range of 'carrier_mass'
-        totaldf['tot_wi_range'] = (totaldf.PercentHFJob>50) & (totaldf.PercentHFJob<=100)
-        self.df = pd.merge(self.df,totaldf[['UploadKey','total_mass','tot_wi_range']],
-                           on='UploadKey',how='left',validate='m:1')
-        self.df['bgMass'] = np.where(self.df.tot_wi_range,
-                                    (self.df.PercentHFJob/100)*self.df.total_mass,
-                                    np.NaN)
-        
-        self.df.DQ_code = np.where((self.df.tot_wi_range)&(self.df.PercentHFJob>0),
-                                   self.df.DQ_code.str[:]+'-M',
-                                   self.df.DQ_code)
-        self.df.DQ_code = np.where(self.df.tot_wi_range,
-                           self.df.DQ_code.str[:]+'-A',
-                           self.df.DQ_code)
+        res = [totaldf[c].values[None,:] for c in ['within_tol','tot_wi_range',
+                                                   'total_mass','in_range']]
+        res[1] = res[1]==True
+        bgMass, flags = _record_results(self.cache,*res)
+        if self.ev_df is None:
+            self.df['total_mass'] = self.seg.broadcast(totaldf.total_mass.values)
+            self.df['tot_wi_range'] = self.seg.broadcast(totaldf.tot_wi_range.values)
+        else: # keep the totals on the event table
+            self.ev_df['total_mass'] = totaldf.total_mass.values
+            self.ev_df['tot_wi_range'] = totaldf.tot_wi_range.values
+        self.df['bgMass'] = bgMass[0]
+        self.df.DQ_flags = flags[0]
+
+    def sweep(self,param_sets):
+        """ bgMass and DQ_flags for each of `param_sets`; see sweep()"""
+        return sweep(self.cache,param_sets)
+
+    def save_cache(self,fn):
+        save_cache(self.cache,fn)
 
     def run(self):
-        self._total_percent_within_range()
         self._get_carrier_names()
+        self._make_cache()
+        self._total_percent_within_range()
         totaldf = self._get_total_event_mass()
         self._calc_all_record_masses(totaldf)
         return self.df
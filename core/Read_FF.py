@@ -9,14 +9,74 @@ This module is used to read all the raw data in from a FracFocus excel zip file
 Input is simply the name of the archive file.  We expect that file to be
 in the .\sources\ directory of the parent folder.
 
-All variables are read into the 'final' df.  Re-typing and processing is
-performed downstream in other modules.
+All variables are read into the 'final' df.  The data types of the known
+FracFocus columns are declared in `ff_schema` and applied while parsing, so
+that the big text fields with few distinct values are held as categoricals
+instead of millions of repeated strings.  Further processing is performed
+downstream in other modules.
 
 """
-import zipfile
+import zipfile, os, hashlib
 import pandas as pd
+import core.Col_store as cs
+from concurrent.futures import ProcessPoolExecutor
 #import numpy as np
 
+# declared types of the columns in the FracFocusRegistry files. Columns not
+# listed here are left for pandas to infer.  Numeric fields use the nullable
+# types: floats already carry NaN, the integer fields use 'Int64'.
+ff_schema = {# low-cardinality text fields
+             'OperatorName':'category', 'Supplier':'category',
+             'Purpose':'category', 'StateName':'category',
+             'CountyName':'category', 'FFVersion':'category',
+             'Projection':'category', 'Source':'category',
+             'ClaimantCompany':'category',
+             # integer fields
+             'APINumber':'Int64', 'StateNumber':'Int64',
+             'CountyNumber':'Int64',
+             # float fields
+             'Latitude':'float64', 'Longitude':'float64', 'TVD':'float64',
+             'TotalBaseWaterVolume':'float64',
+             'TotalBaseNonWaterVolume':'float64',
+             'PercentHighAdditive':'float64', 'PercentHFJob':'float64',
+             'PurposePercentHFJob':'float64', 'MassIngredient':'float64',
+             # booleans
+             'FederalWell':'boolean', 'IndianWell':'boolean',
+             'IngredientMSDS':'boolean'}
+
+
+def _schema_hash():
+    """ a short hash of ff_schema, so that cached members parsed with other
+    types are not reused"""
+    return hashlib.md5(repr(sorted(ff_schema.items())).encode()).hexdigest()[:16]
+
+
+def _unify_categories(dflist):
+    """ concatenating categoricals with different categories falls back to
+    object columns, so give every frame the union of the categories first."""
+    for col in dflist[0].columns:
+        if str(dflist[0][col].dtype)!='category': continue
+        cats = pd.api.types.union_categoricals([t[col] for t in dflist]).categories
+        for t in dflist:
+            t[col] = t[col].cat.set_categories(cats)
+    return dflist
+
+
+def _read_member(zname,fn,import_cols):
+    """read a single FracFocusRegistry member of the archive.  Kept at the
+    module level so that it can be handed to worker processes."""
+    with zipfile.ZipFile(zname) as z:
+        with z.open(fn) as f:
+            t = pd.read_csv(f,low_memory=False,
+                            usecols=import_cols,
+                            dtype=ff_schema,
+                            # ignore pandas default_na values
+                            keep_default_na=False,na_values='')
+    # this variable is used to make it easier to find the
+    # original source of data.
+    t['raw_filename'] = pd.Categorical([fn]*len(t))
+    return t
+
 
 class Read_FF():
     
@@ -26,16 +86,15 @@ class Read_FF():
         self.keep_list = keep_list
         self._get_raw_cols_to_import()
         self.pickle_fn = './out/raw_df_pickle.pkl'
+        self.store = cs.Col_store('./out/raw_df_store/')
+        # per-member parsed frames and the manifest of what is in them
+        self.cachedir = './out/raw_cache/'
+        self.manifest_fn = self.cachedir+'manifest.csv'
         
     def _get_raw_cols_to_import(self):
         """just samples one file to retrieve the column list"""
         with zipfile.ZipFile(self.zname) as z:
-            infiles = []
-            for fn in z.namelist():
-                # the files in the FF archive with the Ingredient records
-                #  always start with this prefix...
-                if fn[:17]=='FracFocusRegistry':
-                    infiles.append(fn)
+            infiles = self._get_infiles(z)
             for fn in infiles[0:1]:
                 with z.open(fn) as f:
                     t = pd.read_csv(f,low_memory=False,nrows=2,
@@ -49,49 +108,138 @@ class Read_FF():
             if col in self.keep_list: self.import_cols.append(col)
 
             
-    def import_raw(self,num_infiles='all',make_pickle=True):
+    def _get_infiles(self,z):
+        infiles = []
+        for fn in z.namelist():
+            # the files in the FF archive with the Ingredient records
+            #  always start with this prefix...
+            if fn[:17]=='FracFocusRegistry':
+                infiles.append(fn)
+        return infiles
+
+    def _get_manifest(self):
+        """ the manifest records, for each cached member, the size and CRC
+        found in the zip directory, the columns that were imported, the
+        schema they were parsed with and the archive they came from."""
+        try:
+            return pd.read_csv(self.manifest_fn,keep_default_na=False)
+        except:
+            return pd.DataFrame({'fn':[],'file_size':[],'CRC':[],'cols':[],
+                                 'schema':[],'zname':[]})
+
+    def _member_cache_fn(self,fn):
+        return self.cachedir+fn+'.pkl'
+
+    def _get_changed_members(self,z,infiles):
+        """return the members whose parsed cache is missing or stale, along
+        with the new manifest for all of `infiles`.  When the manifest was
+        made with another ff_schema or from another archive, every member is
+        taken as changed."""
+        old = self._get_manifest()
+        old = old.set_index('fn')
+        cols = '|'.join(self.import_cols)
+        schema = _schema_hash()
+        rows = []
+        changed = []
+        for fn in infiles:
+            info = z.getinfo(fn)
+            rows.append({'fn':fn,'file_size':info.file_size,
+                         'CRC':info.CRC,'cols':cols,'schema':schema,
+                         'zname':self.zname})
+            try:
+                rec = old.loc[fn]
+                same = (int(rec['file_size'])==info.file_size) & \
+                       (int(rec['CRC'])==info.CRC) & (rec['cols']==cols) & \
+                       (rec['schema']==schema) & (rec['zname']==self.zname)
+            except KeyError: # not in the manifest, or an older manifest
+                same = False
+            if not (same and os.path.exists(self._member_cache_fn(fn))):
+                changed.append(fn)
+        return changed, pd.DataFrame(rows)
+
+    def _parse_members(self,infiles,num_workers=1):
+        """ returns a dict of {member name: parsed df}"""
+        if len(infiles)==0: return {}
+        if (num_workers is None) or (num_workers>1):
+            print(f' -- processing {len(infiles)} files with {num_workers} workers')
+            with ProcessPoolExecutor(max_workers=num_workers) as pool:
+                # map returns results in the order of infiles
+                dflist = list(pool.map(_read_member,
+                                       [self.zname]*len(infiles),
+                                       infiles,
+                                       [self.import_cols]*len(infiles)))
+        else:
+            dflist = []
+            for fn in infiles:
+                print(f' -- processing {fn}')
+                dflist.append(_read_member(self.zname,fn,self.import_cols))
+        return dict(zip(infiles,dflist))
+
+    def import_raw(self,num_infiles='all',make_pickle=True,num_workers=1,
+                   incremental=False,use_store=False):
         """
         `num_files: 'all' (default). Otherwise, use integer to include subset and
         reduce run time.
+        `num_workers`: 1 (default) reads the archive members one after another.
+        Larger values spread the members across a pool of that many processes;
+        the frames are still assembled in member order so that 'ingkey' and
+        'raw_filename' are identical to the serial read.
+        `incremental`: when True, each parsed member is cached in `cachedir`
+        and only the members whose size or CRC (from the zip directory) differ
+        from the manifest are parsed again.  A change of ff_schema or of the
+        archive makes all members be parsed again.
         
         Because we are interested in documenting the different states of 'missing'
         data, we assign NaN values to only the empty cells (''), and keep characters
         entered as is.  Later in the process, the NaN will be transformed to a 
         string ('_empty_entry_') for string non-numeric fields.
+        
+        `use_store`: when True, `make_pickle` saves to the column store instead
+        of the single pickle.
         """
         if self.keep_list==None:
             self.keep_list = self.import_cols
-        dflist = []
+        if not self.keep_list: print('WARNING: no keep_list in Read_FF')
         with zipfile.ZipFile(self.zname) as z:
-            infiles = []
-            for fn in z.namelist():
-                # the files in the FF archive with the Ingredient records
-                #  always start with this prefix...
-                if fn[:17]=='FracFocusRegistry':
-                    infiles.append(fn)
-                    
+            infiles = self._get_infiles(z)
             if num_infiles=='all': last = len(infiles)
             else: last = num_infiles
-            for fn in infiles[:last]:
-                with z.open(fn) as f:
-                    print(f' -- processing {fn}')
-                    if not self.keep_list: print('WARNING: no keep_list in Read_FF')
-                    t = pd.read_csv(f,low_memory=False,
-                                    usecols=self.import_cols,
-                                    # ignore pandas default_na values
-                                    keep_default_na=False,na_values='')
-                    
-                    # this variable is used to make it easier to find the
-                    # original source of data.
-                    t['raw_filename'] = fn
-                    dflist.append(t)
-        final = pd.concat(dflist,sort=True)
+            infiles = infiles[:last]
+            if incremental:
+                to_parse, manifest = self._get_changed_members(z,infiles)
+                print(f' -- {len(infiles)-len(to_parse)} of {len(infiles)} files unchanged since last import')
+            else:
+                to_parse = infiles
+        
+        parsed = self._parse_members(to_parse,num_workers=num_workers)
+        if incremental:
+            os.makedirs(self.cachedir,exist_ok=True)
+            for fn in to_parse:
+                parsed[fn].to_pickle(self._member_cache_fn(fn))
+            # keep the entries of members not read this time (num_infiles)
+            old = self._get_manifest()
+            old = old[~old.fn.isin(manifest.fn)]
+            if len(old)>0: manifest = pd.concat([old,manifest],sort=False)
+            manifest.to_csv(self.manifest_fn,index=False)
+        dflist = []
+        for fn in infiles:
+            if fn in parsed: dflist.append(parsed[fn])
+            else: dflist.append(pd.read_pickle(self._member_cache_fn(fn)))
+        parsed = None
+        final = pd.concat(_unify_categories(dflist),sort=True)
         final.reset_index(drop=True,inplace=True) #  single integer as index
         final['ingkey'] = final.index.astype(int) # create a basic integer index for easier reference
         if make_pickle:
-            final.to_pickle(self.pickle_fn)
+            if use_store: self.store.save(final)
+            else: final.to_pickle(self.pickle_fn)
         return final
         
-    def get_raw_pickle(self):
+    def get_raw_pickle(self,col_list=None):
+        """ fetch the raw_df, optionally only the columns in `col_list`. The
+        column store is used when it is at least as new as the pickle."""
+        if self.store.is_current(self.pickle_fn):
+            return self.store.load(col_list)
         print('Fetching raw_df from pickle')
-        return  pd.read_pickle(self.pickle_fn)
+        df = pd.read_pickle(self.pickle_fn)
+        if col_list is None: return df
+        return df[col_list]
@@ -5,13 +5,24 @@ Created on Wed Apr 17 10:34:50 2019
 @author: GAllison
 """
 import pandas as pd
+import numpy as np
 import core.Read_FF as rff
 import core.Parse_raw as p_raw
 import core.Categorize_records as cat_r
 import core.Process_mass as proc_mass
+import core.Value_classes as vc
 import core.Add_bg_columns as abc
+import core.Col_store as cs
+import core.DQ_flags as dq
 import os
 
+# the columns added by the processing, in the order the flat run adds them;
+# the split tables are joined back in this order
+added_cols = ['api10','date','bgSystemApproach','sys_sup_guess','DQ_flags',
+              'perfect_match','bgCAS','cas_typo','proprietary','un_cas_like',
+              'dup','redundant_rec','bgSupplier','bgSystemSupplier','ok',
+              'no_redund','is_carrier','total_mass','tot_wi_range','bgMass',
+              'DQ_code']
 
 class Run_Full_Process():
     """used to process a given archive to a set of tables 
@@ -23,68 +34,164 @@ class Run_Full_Process():
         self.sourcedir = sourcedir
         self.outdir = './out/'+zname+'/'
         self.pickle_fn = self.outdir+'FF_full.pkl'
+        self.store = cs.Col_store(self.outdir+'FF_full_store/')
+        self.mass_cache_fn = self.outdir+'mass_cache.npz'
+        # distinct Purpose/IngredientName values already classified
+        self.classes = vc.Value_classes(self.outdir+'value_classes/')
         try:
             os.mkdir(self.outdir) # if it doesn't exist yet...
         except:
             pass
         
-    def run_full(self,pickle_out=True,use_pickle=False,new_field_dic=False):
-        """ create new data set by importing a full set """
+    def run_full(self,pickle_out=True,use_pickle=False,new_field_dic=False,
+                 num_workers=1,incremental=False,use_store=False,
+                 split_tables=False,mass_params={}):
+        """ create new data set by importing a full set.
+        `num_workers` > 1 reads the raw archive members in parallel.
+        `incremental` re-parses only the archive members that changed since
+        the last import (see Read_FF.import_raw).
+        `use_store` saves the final data set to the column store rather than
+        a single pickle, so that later readers can load just a few columns.
+        `split_tables` processes an event table and an ingredient table
+        (see Parse_raw.split_tables) and joins them only at the end; the
+        tables are left in self.ev_df and self.ing_df.
+        `mass_params` overrides the tolerances of Process_mass; other values
+        can be tried afterwards with mass_sweep."""
         p = p_raw.Parse_raw(outdir=self.outdir)
         if use_pickle:
             print('Using pickled raw data as input')
             c = self.get_full_pickle(col_list=p.get_keep_list())
         else:
             # if not using pickle, import all columns (don't use keeplist)
-            c = rff.Read_FF(zname=self.zname).import_raw()
-            c = p.cleanup(c)
-            c = p.clean_events(c)
-            if new_field_dic:
-                p.make_field_dicts(c)
-            cr = cat_r.Categorize_records(c,p)
-            c = cr.do_all()
+            c = rff.Read_FF(zname=self.zname).import_raw(num_workers=num_workers,
+                                                        incremental=incremental)
+            if split_tables:
+                c = self._run_split_tables(p,c,new_field_dic,mass_params)
+            else:
+                c = p.cleanup(c)
+                c = p.clean_events(c)
+                if new_field_dic:
+                    p.make_field_dict(c)
+                cr = cat_r.Categorize_records(c,p)
+                c = cr.do_all()
+                
+                add_bg = abc.Add_bg_columns(c)
+                c = add_bg.add_all_cols()
+                
             
-            add_bg = abc.Add_bg_columns(c)
-            c = add_bg.add_all_cols()
-            
-        
-            print(c.columns)
-            pm = proc_mass.Process_mass(c)
-            c = pm.run()
+                print(c.columns)
+                pm = proc_mass.Process_mass(c,params=mass_params,
+                                            classes=self.classes)
+                c = pm.run()
+                pm.save_cache(self.mass_cache_fn)
+                # the DQ_code string is kept for backward compatibility
+                c['DQ_code'] = dq.to_DQ_code(c.DQ_flags)
         
         if pickle_out: # save giant dataframe as a pickle; makes it easy to import later
-            print(f'Pickling final. Total records: {len(c)}')
-            c.to_pickle(self.pickle_fn)
+            if use_store:
+                print(f'Storing final. Total records: {len(c)}')
+                self.store.save(c)
+                self.store.save_index('dq_flags',self._get_flags(c))
+            else:
+                print(f'Pickling final. Total records: {len(c)}')
+                c.to_pickle(self.pickle_fn)
         else:
             print('Not pickling.')
         return c
     
+    def _run_split_tables(self,p,raw_df,new_field_dic=False,mass_params={}):
+        """ the processing steps of run_full on the event and ingredient
+        tables; returns the joined (flat) data set."""
+        ev_df, ing_df = p.split_tables(raw_df)
+        raw_df = None
+        ev_df, ing_df = p.cleanup_tables(ev_df,ing_df)
+        ing_df = p.clean_events_tables(ev_df,ing_df)
+        if new_field_dic:
+            p.make_field_dict(p.join_tables(ev_df,ing_df,added_cols))
+        ing_df = cat_r.Categorize_records(ing_df,p).do_all()
+        ing_df = abc.Add_bg_columns(ing_df)._add_cols()
+        ev_df = abc.Add_bg_columns(ev_df)._add_supp_cols()
+        pm = proc_mass.Process_mass(ing_df,ev_df=ev_df,params=mass_params,
+                                    classes=self.classes)
+        ing_df = pm.run()
+        pm.save_cache(self.mass_cache_fn)
+        ing_df['DQ_code'] = dq.to_DQ_code(ing_df.DQ_flags)
+        self.ev_df, self.ing_df = pm.ev_df, ing_df
+        return p.join_tables(self.ev_df,self.ing_df,added_cols)
+
+    def mass_sweep(self,param_sets):
+        """ bgMass and DQ_flags of every record of the last run_full for each
+        of `param_sets` (see Process_mass.sweep), without running it again."""
+        return proc_mass.sweep(proc_mass.load_cache(self.mass_cache_fn),param_sets)
+
+    def _get_flags(self,df):
+        """ the DQ_flags of df; data sets saved before the flags existed
+        only have DQ_code"""
+        if 'DQ_flags' in df.columns: return df.DQ_flags.values
+        return dq.from_DQ_code(df.DQ_code)
+
+    def _get_frame(self,col_list=None):
+        """ fetch the final data set from the column store (only `col_list`)
+        if it is current, otherwise from the pickle.  A requested 'DQ_flags'
+        is made from DQ_code when the data set doesn't have it."""
+        if self.store.is_current(self.pickle_fn):
+            if (col_list is not None) and ('DQ_flags' in col_list) and \
+               ('DQ_flags' not in self.store.get_columns()):
+                df = self.store.load([c for c in col_list if c!='DQ_flags']+['DQ_code'])
+            else:
+                return self.store.load(col_list)
+        else:
+            df = pd.read_pickle(self.pickle_fn)
+            if col_list is None: return df
+        if ('DQ_flags' in col_list) and ('DQ_flags' not in df.columns):
+            df['DQ_flags'] = self._get_flags(df)
+        return df[col_list]
+
     def get_full_pickle(self,all_cols=True,
                         col_list=['UploadKey','CASNumber','IngredientName','Purpose','OperatorName',
                                    'Supplier','MassIngredient','PercentHFJob','DQ_code',
                                    'bgCAS','bgMass','JobStartDate','date','StateName','api10',
                                    'bgSupplier']):
         """retrieve the pickled data set, optionally with a subset of columns"""
-        df = pd.read_pickle(self.pickle_fn)
-        if all_cols: return df.copy()
-        return df[col_list].copy()
+        if all_cols: return self._get_frame()
+        return self._get_frame(col_list)
     
     def get_filtered_pickle(self,keepcodes = 'M|3',removecodes= 'R|1|2|4|5',all_cols=True,
                         col_list=['UploadKey','CASNumber','IngredientName','Purpose','OperatorName',
                                    'Supplier','MassIngredient','PercentHFJob','DQ_code',
                                    'bgCAS','bgMass','JobStartDate','date','StateName','api10',
                                    'bgSupplier']):
-        """retrieve the pickled data set, optionally with a subset of columns"""
-        df = pd.read_pickle(self.pickle_fn)
-        if all_cols: df = df.copy()
-        else: df = df[col_list].copy()
+        """retrieve the pickled data set, optionally with a subset of columns.
+        When the column store and its flag index are current and the codes
+        are simple lists of flags, only the matching rows of the requested 
+        columns are read."""
+        rows = self._get_filtered_rows(keepcodes,removecodes)
+        if rows is not None:
+            if all_cols: return self.store.load(rows=rows)
+            return self.store.load(col_list,rows=rows)
+        if all_cols: df = self._get_frame()
+        else: df = self._get_frame(col_list)
         if keepcodes: df = df[df.DQ_code.str.contains(keepcodes)]
         if removecodes: df = df[~df.DQ_code.str.contains(removecodes)]
         return df.copy()
 
+    def _get_filtered_rows(self,keepcodes,removecodes):
+        """ row positions selected by the codes using the stored flag index;
+        None if the index can't be used."""
+        if not self.store.is_current(self.pickle_fn): return None
+        flags = self.store.load_index('dq_flags')
+        if flags is None: return None
+        keep = dq.codes_to_bits(keepcodes) if keepcodes else 0
+        remove = dq.codes_to_bits(removecodes) if removecodes else 0
+        if (keep is None) or (remove is None): return None
+        cond = np.ones(len(flags),dtype=bool)
+        if keep: cond &= dq.has_flag(flags,keep)
+        if remove: cond &= ~dq.has_flag(flags,remove)
+        return np.flatnonzero(cond)
+
     def make_filtered_raw_guide(self):
         """ save a list of ingkey that is used to filter raw_df for FF_stats"""
         print('making raw_filtered_guide')
-        df = pd.read_pickle(self.pickle_fn)
-        newdf = df[~df.DQ_code.str.contains('1|2')][['ingkey']].copy()
-        newdf.to_csv('./out/raw_filtered_guide.csv',index=False)        
\ No newline at end of file
+        df = self._get_frame(['ingkey','DQ_flags'])
+        newdf = df[~dq.has_flag(df.DQ_flags,dq.EMPTY_EVENT|dq.DUP_EVENT)][['ingkey']].copy()
+        newdf.to_csv('./out/raw_filtered_guide.csv',index=False)        
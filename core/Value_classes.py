@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Value_classes answers yes/no questions about the text of a column (e.g. is
+this Purpose a carrier?) once per distinct value, and can keep the answers
+on disk between runs.
+"""
+import os
+import numpy as np
+import pandas as pd
+
+version = 1 # change it when any of the predicates change
+
+def _is_carrier(vals):
+    """ 'carrier' or 'base' (fluid) Purposes; the long strings of events that
+    cram several purposes into one cell are left out"""
+    clean = vals.str.strip().str.lower()
+    return (clean.str.contains('carrier',regex=False) \
+            | clean.str.contains('base',regex=False)) & (clean.str.len()<50)
+
+def _contains(word):
+    def pred(vals):
+        return vals.str.lower().str.contains(word,regex=False)
+    return pred
+
+# column -> {predicate name: function of a Series of distinct values}
+predicates = {'Purpose':{'is_carrier':_is_carrier},
+              'IngredientName':{'is_water':_contains('water'),
+                                'is_h2o':_contains('h2o')}}
+
+
+class Value_classes():
+    def __init__(self,dirname=None):
+        self.dirname = dirname
+        self.tables = {}
+
+    def _fn(self,col):
+        return self.dirname+col+'_classes.pkl'
+
+    def _get_table(self,col):
+        if col in self.tables: return self.tables[col]
+        table = pd.DataFrame(columns=list(predicates[col].keys()),dtype=bool,
+                             index=pd.Index([],dtype=object))
+        if (self.dirname is not None) and os.path.exists(self._fn(col)):
+            saved = pd.read_pickle(self._fn(col))
+            if saved['version']==version: table = saved['table']
+        self.tables[col] = table
+        return table
+
+    def _save_table(self,col):
+        os.makedirs(self.dirname,exist_ok=True)
+        tmp = self._fn(col)+'.tmp'
+        pd.to_pickle({'version':version,'table':self.tables[col]},tmp)
+        os.replace(tmp,self._fn(col))
+
+    def _add_values(self,col,vals):
+        """ test the new distinct `vals` and add them to the table"""
+        vals = pd.Series(vals,dtype=object)
+        new = pd.DataFrame({name:pred(vals).fillna(False).values.astype(bool)
+                            for name,pred in predicates[col].items()},
+                           index=pd.Index(vals.values,dtype=object))
+        self.tables[col] = pd.concat([self._get_table(col),new])
+        if self.dirname is not None: self._save_table(col)
+
+    def lookup(self,ser,col=None):
+        """ a dict of {predicate name: boolean array over the records of
+        `ser`} for the predicates of `col` (default: ser.name).  Missing
+        values are False."""
+        col = ser.name if col is None else col
+        codes,uniques = pd.factorize(ser)
+        uniques = np.asarray(uniques,dtype=object)
+        pos = self._get_table(col).index.get_indexer(uniques)
+        if (pos<0).any():
+            self._add_values(col,uniques[pos<0])
+            pos = self.tables[col].index.get_indexer(uniques)
+        table = self.tables[col]
+        out = {}
+        for name in predicates[col]:
+            # the last entry is for a missing value (code -1)
+            out[name] = np.append(table[name].values.astype(bool)[pos],
+                                  False).take(codes)
+        return out
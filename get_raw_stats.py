@@ -12,7 +12,7 @@ import core.FF_stats as ffs
 
 c = rfp.Run_Full_Process()
 df = c.get_full_pickle(all_cols=True)
-print(df.columns,'\n\n\n\')
+print(df.columns,'\n\n\n')
 f = ffs.FF_stats(df)
 print('*'*60)
 print('*'*20,'  UNFILTERED DATA  ','*'*20)
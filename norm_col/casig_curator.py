@@ -33,13 +33,16 @@ This version uses the matches from an LSH procedure
 import pandas as pd
 import numpy as np
 nan = np.nan
-import pickle, csv
+import pickle, csv, os
 import core.CAS_tools as ct
 import core.Lsh_tools as lsh
+import core.Parse_raw as p_raw
+import core.CAS_ref_index as cri
 
 outdir = './norm_col/casig/'
 refdir = './CAS_ref/out/'
-field_dic_fn = './out/currentData/_field_dic.pkl'
+field_dic_dir = './out/currentData/'
+field_dic_fn = field_dic_dir+'_field_dic.pkl' # older, single file
 match_fn = './out/casig_matches_2019_06_10.pkl'
 out_fn = outdir+'xlate_casig.csv'
 potentials_fn = './out/casig_potentials.pkl'
@@ -61,11 +64,14 @@ class Casig_curator():
 
     def _get_field_dic(self):
         """takes the precompiled field_dic and creates casig_orig df from it."""
-        with open(field_dic_fn,'rb') as f:
-            field_dic = pickle.load(f)
-        self.casig_orig = field_dic['casig']
+        pr = p_raw.Parse_raw(outdir=field_dic_dir)
+        if (not os.path.exists(pr.field_dic_dir)) and os.path.exists(field_dic_fn):
+            with open(field_dic_fn,'rb') as f:
+                self.casig_orig = pickle.load(f)['casig']
+        else:
+            self.casig_orig = pr.get_field_dict_entry('casig')
         self.casig_orig['cas_clean'] = self.casig_orig.CASNumber.str.replace(r'[^0-9-]','')
-        self.casig_orig['zero_corrected'] = self.casig_orig.cas_clean.map(lambda x: ct.correct_zeros(x) )
+        self.casig_orig['zero_corrected'] = ct.correct_zeros_array(self.casig_orig.cas_clean)
         
         # now the Ingredients
         self.casig_orig['ig_clean'] = self.casig_orig.IngredientName.str.strip().str.lower()
@@ -142,7 +148,7 @@ class Casig_curator():
             clean[(CAS,ig)] = zc
         for tup in self.res_dic.keys():
             if self.res_dic[tup][1]==0:  # if not-classified
-                if clean[tup] in self.cas_ref_dict.keys(): # keep as original
+                if clean[tup] in self.cas_ref_dict: # keep as original
                     self.res_dic[tup] = (clean[tup],1)
         self._save_results_dic()
                 
@@ -157,14 +163,9 @@ class Casig_curator():
         
     def _get_ref_dic(self):
         # cas reference pickle created by 'CAS Reference dataset.ipynb'
-        with open(refdir+'cas_ref_dic_pickle.pkl','rb') as f:
-            self.cas_ref_dict = pickle.load(f)
-        
-        accum = 0
-        for cas in self.cas_ref_dict.keys():
-            accum += len(self.cas_ref_dict[cas])
+        self.cas_ref_dict = cri.get_index(refdir)
         print(f'Number of unique CAS_RN in reference dictionary: {len(self.cas_ref_dict)}')
-        print(f'Total number of synonyms in reference dictionary: {accum}')
+        print(f'Total number of synonyms in reference dictionary: {self.cas_ref_dict.num_synonyms()}')
         
     def _pkl_lsh(self,obj,name):
         with open('./out/'+name+'.pkl', 'wb') as f:
@@ -174,10 +175,7 @@ class Casig_curator():
             return pickle.load(f)
 
     def make_ref_lsh_sets(self):
-        ig_ref_lst = []
-        for cas in self.cas_ref_dict.keys():
-            for ig in self.cas_ref_dict[cas]:
-                ig_ref_lst.append(ig)
+        ig_ref_lst = self.cas_ref_dict.all_synonyms()
         print('  -- Reference CAS set')
         self._pkl_lsh(lsh.LSH_set(rawlist=list(self.cas_ref_dict.keys()),
                       thresholds=[1.0,0.9,0.6]),
@@ -276,7 +274,7 @@ class Casig_curator():
         return lst
 
     def _show_ig_list(self,cas):
-        if cas in self.cas_ref_dict.keys():
+        if cas in self.cas_ref_dict:
             print('\n'*3+f'Ref ingredients for {cas}\n')
             for ig in self.cas_ref_dict[cas]:
                 print('  -> '+ig)
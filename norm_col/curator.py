@@ -11,24 +11,32 @@ a field.
      all the other values in the field that may be the same, then add those to
      the xlate file.
 """
-import pickle, csv, re
+import pickle, csv, re, os
 import pandas as pd
 import numpy as np
 import core.Lsh_tools as lsh_tools
+import core.Parse_raw as p_raw
 
 class Curator():
     def __init__(self,col_name='Supplier',
-                 field_dic_name='./out/currentData/_field_dic.pkl'):
+                 field_dic_dir='./out/currentData/',field_dic_name=None):
+        """ `field_dic_name` (deprecated) is the older, single-file field
+        dictionary; its directory is then used as `field_dic_dir`."""
         self.col_name = col_name
+        if field_dic_name is not None:
+            print('WARNING: Curator(field_dic_name=...) is deprecated; use field_dic_dir')
+            field_dic_dir = os.path.dirname(field_dic_name)+'/'
+        else:
+            field_dic_name = field_dic_dir+'_field_dic.pkl'
+        self.field_dic_dir = field_dic_dir
         self.field_dic_name = field_dic_name
-        self._get_field_dic() 
-        self.field_df = self.field_dic[self.col_name].copy()
+        self.field_df = self._get_field_dic() 
+        self.orig_lst = list(self.field_df.sort_values(by='cnt',
+                             ascending=False)['clean'])
         self.field_df.set_index('clean',inplace=True,verify_integrity=True)
         self.workdir = './norm_col/'+self.col_name+'/'
         self._load_ref_names()
         self._load_xlate()
-        self.orig_lst = list(self.field_dic[self.col_name].sort_values(by='cnt',
-                             ascending=False)['clean'])
         self.orig_lsh_fn = self.workdir+'orig_lsh.pkl'
         self.ref_lsh_fn = self.workdir+'ref_lsh.pkl'
         self.min_doc_length = 2
@@ -36,12 +44,15 @@ class Curator():
         self.totalcnt = self._get_total_cnt()
         
     def _get_field_dic(self):
-        with open(self.field_dic_name,'rb') as f:
-            self.field_dic = pickle.load(f)
-    def _clear_field_dic(self):
-        self.field_dic = None
+        """ only this column's entry of the field dictionary is read, unless
+        there is just the older single-file dictionary"""
+        pr = p_raw.Parse_raw(outdir=self.field_dic_dir)
+        if (not os.path.exists(pr.field_dic_dir)) and os.path.exists(self.field_dic_name):
+            with open(self.field_dic_name,'rb') as f:
+                return pickle.load(f)[self.col_name].copy()
+        return pr.get_field_dict_entry(self.col_name)
     def _get_total_cnt(self):
-        return self.field_dic[self.col_name].cnt.sum()
+        return self.field_df.cnt.sum()
     def _get_target_cnt(self,target):
         try:
             return self.field_df.cnt.at[target]